@@ -1,11 +1,42 @@
+import asyncio
+import atexit
+import csv
+import functools
+import hashlib
+import itertools
 import json
 import os
+import random
+import re
+import sqlite3
 import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Optional, Callable
+from typing import Awaitable, Dict, List, Optional, Callable, Tuple
 
-import pandas as pd
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI
+
+try:
+    import faiss
+    import numpy as np
+except ImportError:  # semantic cache is optional; exact-match cache still works
+    faiss = None
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a ~4 chars/token estimate
+    tiktoken = None
+
+try:
+    from orjson import loads as json_loads  # 3-5x faster on the response-parsing path
+except ImportError:
+    json_loads = json.loads
+
+try:
+    from jiter import from_json  # salvages complete events from responses cut off at max_tokens
+except ImportError:
+    from_json = None
 
 # ==================== Configuration ==================== #
 OPENAI_MODEL_NAME = "gpt-4.1"
@@ -13,11 +44,51 @@ OPENAI_MODEL_NAME = "gpt-4.1"
 DATA_CSV_PATH = Path("Dunya_Tur2.csv")
 CONTENT_COLUMN = "Content"
 NEWS_ID_COLUMN = "NewsID"
+INPUT_CHUNK_ROWS = 1024  # rows are streamed from the input this many at a time
 
 OUTPUT_CSV_PATH = Path("CAMEO_Dunya_Tur2_OPENAI.csv")
+PROCESSED_IDS_PATH = Path("CAMEO_Dunya_Tur2_OPENAI.ids")  # one NewsID per line, for resuming
+
+# Output rows are buffered and written every FLUSH_EVERY rows or FLUSH_INTERVAL_SECONDS.
+# Set CAMEO_FLUSH_EVERY_ROW=1 to write each row as soon as it is ready.
+FLUSH_EVERY = 1 if os.environ.get("CAMEO_FLUSH_EVERY_ROW") else 64
+FLUSH_INTERVAL_SECONDS = 30
+
+# Response cache (exact SHA-256 match, plus embedding similarity if faiss is installed)
+CACHE_DB_PATH = Path("CAMEO_Dunya_Tur2_cache.sqlite")
+EMBEDDING_MODEL_NAME = "text-embedding-3-small"
+SEMANTIC_CACHE_THRESHOLD = 0.97
+EMBEDDING_BATCH_SIZE = 256  # texts per embeddings request
+
+# Articles longer than this are cut before being sent (bounds prefill cost and context use)
+MAX_INPUT_TOKENS = 6000
 
 MAX_RETRIES = 4
 RETRY_BACKOFF_SECONDS = 5
+MAX_RETRY_WAIT_SECONDS = 60
+
+# Concurrency / rate limits (keep below your account's RPM/TPM ceiling)
+NUM_CONCURRENT = 16
+MAX_REQUESTS_PER_MINUTE = 500
+MAX_TOKENS_PER_MINUTE = 200_000
+
+# Articles coded per CAMEO request (amortizes the codebook prompt)
+BATCH_SIZE = 8
+
+# Two-pass coding on the live path: a short call picks the top-level categories,
+# then only their sub-codes are sent (~1 KB instead of the ~4 KB codebook). Costs
+# an extra round trip and bypasses the cached full-codebook prefix, so it pays
+# off mostly when prompt caching is unavailable.
+TWO_PASS_CODEBOOK = False
+
+# OpenAI Batch API: half price, results within 24h. Rows it cannot answer
+# fall back to the live (async) path above.
+USE_BATCH_API = True
+BATCH_INPUT_PATH = Path("CAMEO_Dunya_Tur2_batch.jsonl")
+BATCH_API_MAX_REQUESTS = 50_000  # per input file (OpenAI limit)
+# Every line repeats the ~13 KB system prompt, so the 200 MB file limit is usually hit first
+BATCH_API_MAX_BYTES = 190 * 1024 * 1024
+BATCH_POLL_SECONDS = 60
 
 OUTPUT_LANGUAGE = "English"
 
@@ -28,22 +99,147 @@ if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable missing.")
 
 # Initialize Standard OpenAI Client
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 print(f"Using OpenAI Model: {OPENAI_MODEL_NAME}")
 
 
+# ==================== Input trimming ==================== #
+if tiktoken is not None:
+    try:
+        ENCODING = tiktoken.encoding_for_model(OPENAI_MODEL_NAME)
+    except KeyError:  # model newer than the installed tiktoken
+        ENCODING = tiktoken.get_encoding("o200k_base")
+else:
+    ENCODING = None
+
+
+def truncate_to_tokens(text: str, max_tokens: int = MAX_INPUT_TOKENS) -> str:
+    if ENCODING is None:
+        return text[:max_tokens * 4]
+    # Every token covers at least one UTF-8 byte and a character is at most 4 bytes, so this text fits
+    if len(text) * 4 <= max_tokens:
+        return text
+    ids = ENCODING.encode(text, disallowed_special=())  # "<|endoftext|>" in an article is plain text
+    if len(ids) <= max_tokens:
+        return text
+    return ENCODING.decode(ids[:max_tokens])
+
+
+# ==================== Rate limiting ==================== #
+class RateLimiter:
+    """
+    Token bucket over requests/minute and tokens/minute, shared by every worker.
+    A 429 pauses the whole bucket for the server's Retry-After so sibling
+    tasks back off together instead of hitting the same limit.
+    """
+
+    def __init__(self, max_requests_per_minute: int, max_tokens_per_minute: int):
+        self.max_requests = max_requests_per_minute
+        self.max_tokens = max_tokens_per_minute
+        self.available_requests = float(max_requests_per_minute)
+        self.available_tokens = float(max_tokens_per_minute)
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self.condition = asyncio.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        # Nothing refills while throttled
+        elapsed = max(0.0, now - max(self.last_refill, self.paused_until))
+        self.last_refill = now
+        self.available_requests = min(
+            self.max_requests, self.available_requests + self.max_requests * elapsed / 60.0
+        )
+        self.available_tokens = min(
+            self.max_tokens, self.available_tokens + self.max_tokens * elapsed / 60.0
+        )
+
+    def _seconds_until_available(self, est_tokens: int) -> float:
+        missing_requests = max(0.0, 1 - self.available_requests)
+        missing_tokens = max(0.0, est_tokens - self.available_tokens)
+        return max(
+            self.paused_until - time.monotonic(),
+            missing_requests * 60.0 / self.max_requests,
+            missing_tokens * 60.0 / self.max_tokens,
+            0.01,
+        )
+
+    async def acquire(self, est_tokens: int):
+        est_tokens = min(est_tokens, self.max_tokens)
+        async with self.condition:
+            while True:
+                self._refill()
+                if (time.monotonic() >= self.paused_until
+                        and self.available_requests >= 1 and self.available_tokens >= est_tokens):
+                    self.available_requests -= 1
+                    self.available_tokens -= est_tokens
+                    return
+                # Sleep until the bucket can cover this call, or until throttle() changes the picture
+                try:
+                    await asyncio.wait_for(self.condition.wait(), self._seconds_until_available(est_tokens))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def throttle(self, seconds: float):
+        async with self.condition:
+            self._refill()
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.available_requests = 0.0
+            self.available_tokens = 0.0
+            self.condition.notify_all()
+
+
+semaphore = asyncio.Semaphore(NUM_CONCURRENT)
+rate_limiter = RateLimiter(MAX_REQUESTS_PER_MINUTE, MAX_TOKENS_PER_MINUTE)
+
+
+def _estimate_tokens(messages: List[Dict], max_tokens: Optional[int]) -> int:
+    # ~4 characters per token is close enough for budgeting
+    prompt_chars = sum(len(m.get("content", "")) for m in messages)
+    return prompt_chars // 4 + (max_tokens or 0)
+
+
 # ==================== Retry wrapper ==================== #
-def call_with_retries(fn: Callable, max_attempts: int = MAX_RETRIES) -> any:
+# Only these are worth retrying; anything else is a bug or a bad request and is raised at once
+TRANSIENT_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        if response.headers.get("retry-after-ms"):
+            return float(response.headers["retry-after-ms"]) / 1000.0
+        if response.headers.get("retry-after"):
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+async def call_with_retries(fn: Callable[[], Awaitable], max_attempts: int = MAX_RETRIES) -> any:
+    wait = RETRY_BACKOFF_SECONDS
     for attempt in range(1, max_attempts + 1):
         try:
-            return fn()
-        except Exception as exc:
+            return await fn()
+        except TRANSIENT_ERRORS as exc:
             if attempt == max_attempts:
                 raise
-            wait = RETRY_BACKOFF_SECONDS * attempt
-            print(f"Attempt {attempt} failed ({exc}); retrying in {wait}s…")
-            time.sleep(wait)
+            # Decorrelated jitter keeps concurrent workers from retrying in lockstep
+            wait = min(MAX_RETRY_WAIT_SECONDS, random.uniform(RETRY_BACKOFF_SECONDS, wait * 3))
+            server_wait = _retry_after(exc)
+            delay = server_wait if server_wait is not None else wait
+            if isinstance(exc, openai.RateLimitError):
+                await rate_limiter.throttle(delay)
+            print(f"Attempt {attempt} failed ({exc}); retrying in {delay:.1f}s…")
+            await asyncio.sleep(delay)
 
 
 def _language_clause():
@@ -51,21 +247,166 @@ def _language_clause():
 
 
 # ==================== OpenAI wrapper ==================== #
-def run_chat_completion(messages: List[Dict], **kwargs):
-    def api_call():
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL_NAME,
-            messages=messages,
-            **kwargs,
-        )
+async def run_chat_completion(messages: List[Dict], **kwargs):
+    est_tokens = _estimate_tokens(messages, kwargs.get("max_tokens"))
+
+    async def api_call():
+        async with semaphore:
+            await rate_limiter.acquire(est_tokens)
+            response = await client.chat.completions.create(
+                model=OPENAI_MODEL_NAME,
+                messages=messages,
+                **kwargs,
+            )
         return response.choices[0].message.content
 
-    return call_with_retries(api_call)
+    return await call_with_retries(api_call)
+
+
+# ==================== Response cache ==================== #
+class ResponseCache:
+    """
+    Persistent cache of LLM results keyed by article text.
+    Exact hits use the SHA-256 of the text; if faiss is available, texts whose
+    embedding has cosine similarity >= SEMANTIC_CACHE_THRESHOLD with a cached
+    text reuse that text's results. A cache that fails (database or
+    embeddings call) is reported and treated as a miss.
+    """
+
+    def __init__(self, db_path: Path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (kind TEXT, key TEXT, value TEXT, PRIMARY KEY (kind, key))"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self.conn.commit()
+
+        self.semantic = faiss is not None
+        self.keys: List[str] = []
+        self.known_keys = set()
+        self.vectors = OrderedDict()  # recent key -> embedding, avoids re-embedding within a run
+        self.index = None
+
+        if self.semantic:
+            for key, blob in self.conn.execute("SELECT key, vector FROM embeddings"):
+                self._add_vector(key, np.frombuffer(blob, dtype="float32"))
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _get(self, kind: str, key: str):
+        row = self.conn.execute(
+            "SELECT value FROM responses WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        return json_loads(row[0]) if row else None
+
+    def _add_vector(self, key: str, vector):
+        vector = np.asarray(vector, dtype="float32").reshape(1, -1).copy()
+        faiss.normalize_L2(vector)
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(vector.shape[1])
+        self.index.add(vector)
+        self.keys.append(key)
+        self.known_keys.add(key)
+        return vector
+
+    async def _embed_many(self, items: List[Tuple[str, str]]) -> Dict[str, List[float]]:
+        # (key, text) pairs -> {key: embedding}, one request per EMBEDDING_BATCH_SIZE texts not embedded yet
+        vectors = {key: self.vectors[key] for key, _ in items if key in self.vectors}
+        todo = list({key: text for key, text in items if key not in vectors}.items())
+        for i in range(0, len(todo), EMBEDDING_BATCH_SIZE):
+            chunk = todo[i:i + EMBEDDING_BATCH_SIZE]
+            response = await call_with_retries(
+                lambda: client.embeddings.create(model=EMBEDDING_MODEL_NAME, input=[text[:8192] for _, text in chunk])
+            )
+            for (key, _), item in zip(chunk, response.data):
+                vectors[key] = self.vectors[key] = item.embedding
+                if len(self.vectors) > 1024:
+                    self.vectors.popitem(last=False)
+        return vectors
+
+    async def lookup_many(self, kind: str, texts: List[str]) -> List[Optional[Dict]]:
+        hits = [None] * len(texts)
+        try:
+            keys = [self._key(text) for text in texts]
+            hits = [self._get(kind, key) for key in keys]
+            misses = [i for i, hit in enumerate(hits) if hit is None]
+            if not misses or not self.semantic or self.index is None:
+                return hits
+
+            embedded = await self._embed_many([(keys[i], texts[i]) for i in misses])
+            vectors = np.asarray([embedded[keys[i]] for i in misses], dtype="float32")
+            faiss.normalize_L2(vectors)
+            scores, ids = self.index.search(vectors, 1)
+            for i, score, nearest in zip(misses, scores[:, 0], ids[:, 0]):
+                if nearest >= 0 and score >= SEMANTIC_CACHE_THRESHOLD:
+                    hits[i] = self._get(kind, self.keys[nearest])
+        except Exception as exc:
+            print(f"Cache lookup failed ({exc}); treating {len(texts)} article(s) as uncached")
+        return hits
+
+    async def lookup(self, kind: str, text: str):
+        return (await self.lookup_many(kind, [text]))[0]
+
+    async def store_many(self, kind: str, items: List[Tuple[str, Dict]]):
+        # items: (text, value); the results are committed before the (slower, fallible) embeddings step
+        if not items:
+            return
+        try:
+            keys = [self._key(text) for text, _ in items]
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO responses (kind, key, value) VALUES (?, ?, ?)",
+                [(kind, key, json.dumps(value, ensure_ascii=False)) for key, (_, value) in zip(keys, items)],
+            )
+            self.conn.commit()
+            if not self.semantic:
+                return
+
+            new = [(key, text) for key, (text, _) in zip(keys, items) if key not in self.known_keys]
+            embedded = await self._embed_many(new)
+            rows = []
+            for key in embedded:
+                if key not in self.known_keys:  # the same text may be stored twice in one call
+                    rows.append((key, self._add_vector(key, embedded[key]).tobytes()))
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self.conn.commit()
+        except Exception as exc:
+            print(f"Could not cache {len(items)} result(s) ({exc})")
+
+    async def store(self, kind: str, text: str, value):
+        await self.store_many(kind, [(text, value)])
+
+
+response_cache = ResponseCache(CACHE_DB_PATH)
+
+
+def _is_cacheable(result) -> bool:
+    # Never cache failed calls, or responses only partly recovered after a cut-off (a rerun may get all of it)
+    if isinstance(result, dict):
+        return "error" not in result and not result.get("partial")
+    return not str(result).startswith("Error")
+
+
+def cached(kind: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(text_content: str):
+            hit = await response_cache.lookup(kind, text_content)
+            if hit is not None:
+                return hit
+            result = await fn(text_content)
+            if _is_cacheable(result):
+                await response_cache.store(kind, text_content, result)
+            return result
+        return wrapper
+    return decorator
 
 
 # ==================== CAMEO EVENT EXTRACTION ==================== #
-def get_cameo_events_with_llm(text_content: str) -> Dict:
-    system_prompt = f"""
+# Built once at import and kept free of per-call interpolation so the leading
+# tokens are byte-identical on every request (OpenAI prompt-prefix caching).
+CAMEO_PREAMBLE = """
 You are an automated political event coder using the CAMEO 1.1b3 ontology.
 You MUST output valid JSON only. 
 You are an expert in Turkish
@@ -109,22 +450,14 @@ restricting yourself to the category chosen in STEP 1.
   full list below.
 • This sub‑code is your PRIMARY decision; you should treat all sub‑codes
   equally and choose the single best match.
-• AFTER you choose the sub‑code, set the top‑level category to the
-  corresponding two‑digit prefix of that sub‑code (e.g., sub‑code "1384"
-  implies top-level "13").
-
-In other words:
-  - STEP 1 is an initial hypothesis.
-  - STEP 2 is the definitive classification.
-  - The FINAL JSON must be consistent with the sub‑code you choose in STEP 2.
-
-All codes must be zero‑padded strings.
 
 ===========================
 FULL OFFICIAL SUB‑CODE LIST
 ===========================
 
-01: MAKE PUBLIC STATEMENT  
+"""
+
+CAMEO_CODEBOOK = """01: MAKE PUBLIC STATEMENT  
 016 Deny responsibility  
 012 Make pessimistic comment  
 011 Decline comment  
@@ -459,7 +792,9 @@ FULL OFFICIAL SUB‑CODE LIST
 2041 Chemical/biological/radiological attack  
 2042 Nuclear detonation
 
-Rules:
+"""
+
+CAMEO_RULES = """Rules:
 - ALL codes MUST be zero-padded strings.
 - NEVER invent new codes.
 - NEVER output integers.
@@ -483,13 +818,54 @@ GENERAL RULES
   - event_description
   - evidence (direct quotation)
   - confidence (0.0–1.0)
-- If no events, output {{"events": []}}.
+====================================================================
+STEP 4: SUMMARY
+====================================================================
+- As an expert political analyst, also write a 120-word summary of the
+  whole article under the key "summary", even when it has no events.
+"""
+
+CAMEO_INSTRUCTIONS = CAMEO_PREAMBLE + CAMEO_CODEBOOK + CAMEO_RULES
+
+# Codebook parsed once from the prompt above. The top level is always derived
+# from the sub-code prefix here rather than trusted from the model.
+TOP_LEVELS = frozenset(re.findall(r"^(\d{2}) ", CAMEO_INSTRUCTIONS, flags=re.MULTILINE))
+VALID_CODES = frozenset(re.findall(r"^(\d{3,4}) ", CAMEO_INSTRUCTIONS, flags=re.MULTILINE))
+# Every accepted spelling of a code -> (code, top level), so validation is one dict lookup.
+# Top levels ("19") and sub-codes are taken as written; the only repaired spelling is a
+# 4-digit code that lost its leading zero ("311" for "0311"). Stripping the zero off 3-digit
+# codes would turn "019" into "19" and shadow the real top levels 10-20.
+CODE_LOOKUP = {code[1:]: (code, code[:2]) for code in VALID_CODES if len(code) == 4 and code.startswith("0")}
+CODE_LOOKUP.update({code: (code, code) for code in TOP_LEVELS})
+CODE_LOOKUP.update({code: (code, code[:2]) for code in VALID_CODES})
+# "01" -> the "01: MAKE PUBLIC STATEMENT" block of sub-code lines, for the two-pass prompt
+SUBCODES_BY_TOPLEVEL = {block[:2]: block for block in CAMEO_CODEBOOK.strip().split("\n\n")}
+
+
+def validate(ev: Dict) -> bool:
+    """
+    Normalizes ev["cameo_code"] / ev["cameo_top_level"] in place.
+    Returns False (and blanks the sub-code) if the code is not in the codebook.
+    """
+    match = CODE_LOOKUP.get(str(ev.get("cameo_code", "")).strip())
+    if match:
+        ev["cameo_code"], ev["cameo_top_level"] = match
+        return True
+
+    top_level = str(ev.get("cameo_top_level", "")).strip().zfill(2)
+    ev["cameo_code"] = ""
+    ev["cameo_top_level"] = top_level if top_level in TOP_LEVELS else ""
+    return False
+
+
+CAMEO_OUTPUT_FORMAT = """- If no events, output {"summary": "...", "events": []}.
 
 Output format:
 
-{{
+{
+  "summary": "",
   "events": [
-    {{
+    {
       "event_order": 1,
       "source_actor": "",
       "target_actor": "",
@@ -498,48 +874,231 @@ Output format:
       "event_description": "",
       "evidence": "",
       "confidence": 0.0
-    }}
+    }
   ]
-}}
+}
 
-If NONE → {{"events": []}}
+If NONE → {"summary": "...", "events": []}"""
+
+CAMEO_BATCH_OUTPUT_FORMAT = """- After the response-language line, the user message is a JSON list of articles:
+  [{"id": "...", "text": "..."}, ...].
+- Code EACH article independently; never mix events between articles.
+- Return exactly one entry per article, with its "id" copied into "news_id".
+- If an article has no events, return "events": [] (and still its "summary") for that article.
+
+Output format:
+
+{
+  "results": [
+    {
+      "news_id": "",
+      "summary": "",
+      "events": [
+        {
+          "event_order": 1,
+          "source_actor": "",
+          "target_actor": "",
+          "cameo_top_level": "",
+          "cameo_code": "",
+          "event_description": "",
+          "evidence": "",
+          "confidence": 0.0
+        }
+      ]
+    }
+  ]
+}"""
+
+
+CAMEO_SYSTEM_PROMPT = CAMEO_INSTRUCTIONS + CAMEO_OUTPUT_FORMAT + "\n\nYou MUST output valid JSON only.\n"
+CAMEO_BATCH_SYSTEM_PROMPT = CAMEO_INSTRUCTIONS + CAMEO_BATCH_OUTPUT_FORMAT + "\n\nYou MUST output valid JSON only.\n"
+
+
+# Pass 1 of the two-pass codebook: a short prompt that only names the top levels present
+TOP_LEVEL_SYSTEM_PROMPT = """
+You are an automated political event coder using the CAMEO 1.1b3 ontology.
+List every top-level CAMEO category (01–20) that occurs in the political events of the text:
+
+01 Make Statement
+02 Appeal
+03 Express Intent to Cooperate
+04 Consult
+05 Diplomatic Cooperation
+06 Material Cooperation
+07 Provide Aid
+08 Yield
+09 Investigate
+10 Demand
+11 Disapprove
+12 Reject
+13 Threaten
+14 Protest
+15 Exhibit Military or Police Posture
+16 Reduce Relations
+17 Coerce
+18 Assault
+19 Fight
+20 Use Unconventional Mass Violence
+
+Output valid JSON only: {"top_levels": ["01", "04"]}
+If there are no political events → {"top_levels": []}
+"""
 
-You MUST output valid JSON only. {_language_clause()}
-    """
 
+def _codebook_system_prompt(top_levels: List[str], output_format: str) -> str:
+    # Pass 2: the normal prompt, but with only the sub-codes of the selected categories
+    codebook = "\n\n".join(SUBCODES_BY_TOPLEVEL[t] for t in sorted(set(top_levels)))
+    return CAMEO_PREAMBLE + codebook + "\n\n" + CAMEO_RULES + output_format + "\n\nYou MUST output valid JSON only.\n"
+
+
+async def _select_top_levels(user_content: str) -> Optional[List[str]]:
+    """
+    Returns the top-level categories present ([] if no events), or None if
+    pass 1 failed and the full codebook should be used.
+    """
     try:
-        content = run_chat_completion(
+        content = await run_chat_completion(
             [
-                {"role": "system", "content": system_prompt},
-                {"role": "assistant", "content": "I will output JSON as instructed."},
-                {"role": "user", "content": text_content}
+                {"role": "system", "content": TOP_LEVEL_SYSTEM_PROMPT},
+                {"role": "user", "content": user_content}
             ],
             response_format={"type": "json_object"},
             temperature=0.0,
-            max_tokens=1500,  # Increased tokens to handle multiple events
+            max_tokens=100,
         )
-        return json.loads(content)
+        top_levels = [str(t).strip().zfill(2) for t in json_loads(content).get("top_levels", [])]
+        return [t for t in top_levels if t in SUBCODES_BY_TOPLEVEL]
+    except Exception as exc:
+        print(f"Top-level pass failed ({exc}); using the full codebook")
+        return None
+
+
+CAMEO_REQUEST_PARAMS = {
+    "response_format": {"type": "json_object"},
+    "temperature": 0.0,
+    "max_tokens": 1750,  # Room for the summary plus multiple events
+}
+
+
+def _cameo_messages(text_content: str, system_prompt: str = CAMEO_SYSTEM_PROMPT) -> List[Dict]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "assistant", "content": "I will output JSON as instructed."},
+        {"role": "user", "content": f"{_language_clause()}\n\n{text_content}"}
+    ]
+
+
+EVENT_KEYS = ("event_order", "source_actor", "target_actor", "cameo_top_level",
+              "cameo_code", "event_description", "evidence", "confidence")
+
+# How many responses were parsed and how many needed the partial path
+truncation_stats = {"parsed": 0, "truncated": 0}
+
+
+def parse_llm_json(content: str) -> Dict:
+    """
+    Parses a JSON response. One that was cut off at max_tokens is parsed in
+    jiter's partial mode, keeping every complete entry and dropping the
+    one that was cut off; the result is then marked "partial" so it is not cached.
+    """
+    truncation_stats["parsed"] += 1
+    try:
+        return json_loads(content)
+    except ValueError:
+        if from_json is None:
+            raise
+
+    data = from_json(content.encode("utf-8"), partial_mode=True)
+    if not isinstance(data, dict):
+        raise ValueError("Truncated response is not a JSON object")
+    truncation_stats["truncated"] += 1
+    data["partial"] = True
+
+    events = data.get("events")
+    if isinstance(events, list) and events:
+        last = events[-1]
+        if not (isinstance(last, dict) and all(key in last for key in EVENT_KEYS)):
+            events.pop()
+
+    # The last article's events may be incomplete; it is re-coded on its own
+    results = data.get("results")
+    if isinstance(results, list) and results:
+        results.pop()
+
+    return data
+
+
+@cached("cameo")
+async def get_cameo_events_with_llm(text_content: str) -> Dict:
+    try:
+        system_prompt = CAMEO_SYSTEM_PROMPT
+        if TWO_PASS_CODEBOOK:
+            # An empty selection still yields a prompt with no sub-codes, for the summary
+            top_levels = await _select_top_levels(text_content)
+            if top_levels is not None:
+                system_prompt = _codebook_system_prompt(top_levels, CAMEO_OUTPUT_FORMAT)
+
+        content = await run_chat_completion(_cameo_messages(text_content, system_prompt), **CAMEO_REQUEST_PARAMS)
+        return parse_llm_json(content)
 
     except Exception as exc:
-        return {"events": [], "error": str(exc)}
+        return {"summary": "", "events": [], "error": str(exc)}
 
 
-# ===================== OPTIONAL SUMMARY ===================== #
-def get_summary_with_llm(text_content: str) -> str:
-    system_prompt = f"You are an expert political analyst. Produce a 120-word summary. {_language_clause()}"
+async def get_cameo_events_batch(texts: List[str]) -> List[Dict]:
+    """
+    Codes several articles in one request so the codebook prompt is sent
+    once per batch instead of once per article; returns their results in order.
+    Articles are identified by their position, since NewsIDs may be empty or repeated.
+    Cached articles are answered locally; articles missing from the response
+    (or a failed batch) fall back to single-article calls.
+    """
+    results: List[Optional[Dict]] = await response_cache.lookup_many("cameo", texts)
+    uncached = {str(i): i for i, hit in enumerate(results) if hit is None}
+    if not uncached:
+        return results
+
+    articles = json.dumps(
+        [{"id": article_id, "text": texts[i]} for article_id, i in uncached.items()],
+        ensure_ascii=False,
+    )
+    user_content = f"{_language_clause()}\n\n{articles}"
 
     try:
-        out = run_chat_completion(
+        system_prompt = CAMEO_BATCH_SYSTEM_PROMPT
+        if TWO_PASS_CODEBOOK:
+            top_levels = await _select_top_levels(articles)
+            if top_levels is not None:
+                system_prompt = _codebook_system_prompt(top_levels, CAMEO_BATCH_OUTPUT_FORMAT)
+
+        content = await run_chat_completion(
             [
                 {"role": "system", "content": system_prompt},
-                {"role": "user", "content": text_content}
+                {"role": "assistant", "content": "I will output JSON as instructed."},
+                {"role": "user", "content": user_content}
             ],
-            temperature=0.3,
-            max_tokens=250,
+            response_format={"type": "json_object"},
+            temperature=0.0,
+            max_tokens=CAMEO_REQUEST_PARAMS["max_tokens"] * len(uncached),
         )
-        return out.strip()
+        coded = []
+        for entry in parse_llm_json(content).get("results", []):
+            # The prompt has the model copy each article's "id" into "news_id"
+            i = uncached.get(str(entry.get("news_id", "")).strip())
+            if i is not None and results[i] is None:
+                results[i] = {"summary": entry.get("summary", ""), "events": entry.get("events", [])}
+                coded.append((texts[i], results[i]))
+        await response_cache.store_many("cameo", coded)
     except Exception as exc:
-        return f"Error: {exc}"
+        print(f"Batch of {len(texts)} failed ({exc}); falling back to per-article calls")
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        fallback = await asyncio.gather(*(get_cameo_events_with_llm(texts[i]) for i in missing))
+        for i, result in zip(missing, fallback):
+            results[i] = result
+
+    return results
 
 
 # ===================== CSV HELPERS ===================== #
@@ -561,114 +1120,362 @@ OUTPUT_COLUMNS = [
 ]
 
 
-def ensure_output_csv():
-    if not OUTPUT_CSV_PATH.exists():
-        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(
-            OUTPUT_CSV_PATH,
-            index=False,
-            encoding="utf-8-sig"
-        )
+def one_line(value) -> str:
+    # Free-text fields are flattened so every CSV record stays on one physical line
+    return str(value).replace("\r\n", " ").replace("\r", " ").replace("\n", " ")
 
 
-def load_existing_results():
+class BufferedCSVWriter:
+    """
+    csv.DictWriter that writes rows in chunks instead of one at a time.
+    NewsIDs marked as processed are appended to the sidecar file only after
+    their rows have been written, so a resumed run never skips unsaved rows.
+    """
+
+    def __init__(self, f, ids_file, fieldnames: List[str]):
+        self.f = f
+        self.ids_file = ids_file
+        self.writer = csv.DictWriter(f, fieldnames=fieldnames, dialect="excel", quoting=csv.QUOTE_MINIMAL)
+        self.pending: List[Dict] = []
+        self.pending_ids: List[str] = []
+        self.last_flush = time.monotonic()
+
+    def writeheader(self):
+        self.writer.writeheader()
+        self.f.flush()
+
+    def writerows(self, records: List[Dict]):
+        # All rows of one article go in together, with one flush check per article
+        self.pending.extend(records)
+        if (len(self.pending) >= FLUSH_EVERY
+                or time.monotonic() - self.last_flush >= FLUSH_INTERVAL_SECONDS):
+            self.flush()
+
+    def mark_processed(self, news_id: str):
+        self.pending_ids.append(news_id)
+
+    def flush(self):
+        if self.f.closed:
+            return
+        if self.pending:
+            self.writer.writerows(self.pending)
+            self.pending.clear()
+        self.f.flush()
+        if self.pending_ids:
+            self.ids_file.write("".join(f"{news_id}\n" for news_id in self.pending_ids))
+            self.ids_file.flush()
+            self.pending_ids.clear()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+        self.ids_file.close()
+
+
+def open_output_csv() -> BufferedCSVWriter:
+    # One handle for the whole run; the header is written only for a new file
+    new_file = not OUTPUT_CSV_PATH.exists()
+    f = OUTPUT_CSV_PATH.open("a", encoding="utf-8-sig", newline="")
+    ids_file = PROCESSED_IDS_PATH.open("a", encoding="utf-8")
+    writer = BufferedCSVWriter(f, ids_file, OUTPUT_COLUMNS)
+    if new_file:
+        writer.writeheader()
+    atexit.register(writer.flush)  # persist buffered rows on Ctrl-C / crash
+    return writer
+
+
+def load_processed_ids() -> set:
+    if PROCESSED_IDS_PATH.exists():
+        return set(PROCESSED_IDS_PATH.read_text(encoding="utf-8").splitlines())
+
+    processed_ids = set()
     if OUTPUT_CSV_PATH.exists():
-        return pd.read_csv(OUTPUT_CSV_PATH, encoding="utf-8-sig")
-    return pd.DataFrame(columns=OUTPUT_COLUMNS)
+        # One-time migration for output written before the sidecar existed
+        with OUTPUT_CSV_PATH.open(encoding="utf-8-sig", newline="") as f:
+            processed_ids = {row.get("NewsID", "") for row in csv.DictReader(f)}
+        PROCESSED_IDS_PATH.write_text("".join(f"{news_id}\n" for news_id in processed_ids), encoding="utf-8")
+    return processed_ids
 
 
-def append_record(record):
-    pd.DataFrame([record], columns=OUTPUT_COLUMNS).to_csv(
-        OUTPUT_CSV_PATH,
-        mode="a",
-        header=not OUTPUT_CSV_PATH.exists(),
-        index=False,
-        encoding="utf-8-sig"
+# ===================== BATCH API ===================== #
+def write_batch_files(rows: List[Tuple]) -> List[Path]:
+    """
+    Writes one events-and-summary request per article, starting a new file
+    whenever the per-file request or size limit is reached. The custom_id is
+    the row position, which (unlike the NewsID) is always present and unique.
+    """
+    paths, f, count, size = [], None, 0, 0
+    for idx, _, _, content in rows:
+        request = {
+            "custom_id": str(idx),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": OPENAI_MODEL_NAME, "messages": _cameo_messages(content), **CAMEO_REQUEST_PARAMS},
+        }
+        data = (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+        if f is None or count >= BATCH_API_MAX_REQUESTS or size + len(data) > BATCH_API_MAX_BYTES:
+            if f:
+                f.close()
+            path = BATCH_INPUT_PATH.with_name(f"{BATCH_INPUT_PATH.stem}_{len(paths)}.jsonl")
+            f = path.open("wb")
+            paths.append(path)
+            count, size = 0, 0
+        f.write(data)
+        count += 1
+        size += len(data)
+    if f:
+        f.close()
+    return paths
+
+
+async def submit_batch_job(path: Path) -> str:
+    with path.open("rb") as f:
+        batch_file = await client.files.create(file=f, purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
     )
+    print(f"Submitted batch {batch.id} ({path})")
+    return batch.id
+
+
+async def collect_batch_job(batch_id: str, output_path: Path) -> Dict[str, str]:
+    while True:
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            break
+        counts = batch.request_counts
+        done = f"{counts.completed}/{counts.total}" if counts else "?"
+        print(f"Batch {batch_id}: {batch.status} ({done})")
+        await asyncio.sleep(BATCH_POLL_SECONDS)
+
+    if not batch.output_file_id:
+        print(f"Batch {batch_id} ended as '{batch.status}' with no output.")
+        return {}
+
+    output = await client.files.content(batch.output_file_id)
+    output_path.write_bytes(output.content)
+
+    results = {}
+    with output_path.open(encoding="utf-8") as f:
+        for line in f:
+            item = json_loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+
+async def process_with_batch_api(groups: List[List[Tuple]], queue: asyncio.Queue, processed_ids: set) -> List[List[Tuple]]:
+    """
+    Codes article groups through the Batch API and returns the groups it
+    could not answer (already cached, failed or missing), for the live path.
+    """
+    # Each group has distinct content, so its first row is submitted once and stands for the others.
+    # Looked up EMBEDDING_BATCH_SIZE at a time, so a semantic cache embeds the articles in batches too
+    to_submit = []
+    for i in range(0, len(groups), EMBEDDING_BATCH_SIZE):
+        chunk = groups[i:i + EMBEDDING_BATCH_SIZE]
+        hits = await response_cache.lookup_many("cameo", [group[0][3] for group in chunk])
+        to_submit.extend(group[0] for group, hit in zip(chunk, hits) if hit is None)
+
+    if not to_submit:
+        return groups
+
+    jobs = []
+    for path in write_batch_files(to_submit):
+        try:
+            jobs.append((await submit_batch_job(path), path))
+        except openai.OpenAIError as exc:
+            # Its rows get no batch result and go to the live path below
+            print(f"Could not submit {path}: {exc}")
+
+    results = {}
+    for batch_id, path in jobs:
+        results.update(await collect_batch_job(batch_id, path.with_name(f"{path.stem}_output.jsonl")))
+
+    remaining, coded = [], []
+    for group in groups:
+        idx, _, _, content = group[0]
+        cameo_content = results.get(str(idx))
+        try:
+            cameo_data = parse_llm_json(cameo_content) if cameo_content is not None else None
+        except ValueError:
+            cameo_data = None
+
+        if cameo_data is None:
+            remaining.append(group)
+            continue
+
+        if _is_cacheable(cameo_data):
+            coded.append((content, cameo_data))
+        await write_group(group, cameo_data, queue, processed_ids)
+    await response_cache.store_many("cameo", coded)
+
+    print(f"Batch API coded {len(groups) - len(remaining)} articles; {len(remaining)} left for live calls.")
+    return remaining
 
 
 # ===================== MAIN ===================== #
-def main():
+async def record_writer(queue: asyncio.Queue, writer: BufferedCSVWriter):
+    # Single consumer so the CSV writer is never used concurrently
+    while True:
+        item = await queue.get()
+        if item is None:
+            writer.flush()
+            queue.task_done()
+            break
+        news_id, records = item
+        writer.writerows(records)
+        writer.mark_processed(news_id)
+        queue.task_done()
+
+
+EMPTY_EVENT_FIELDS = {
+    "event_order": "",
+    "source_actor": "",
+    "target_actor": "",
+    "cameo_top_level": "",
+    "cameo_code": "",
+    "event_description": "",
+    "evidence": "",
+    "confidence": "",
+}
+
+
+def event_fields(ev: Dict) -> Dict:
+    return {
+        "event_order": ev.get("event_order", 1),  # Default to 1 if missing
+        "source_actor": ev.get("source_actor", ""),
+        "target_actor": ev.get("target_actor", ""),
+        "cameo_top_level": ev.get("cameo_top_level", ""),
+        "cameo_code": ev.get("cameo_code", ""),
+        "event_description": one_line(ev.get("event_description", "")),
+        "evidence": one_line(ev.get("evidence", "")),
+        "confidence": ev.get("confidence", ""),
+    }
+
+
+async def queue_article_records(row, news_id: str, cameo_data: Dict, queue: asyncio.Queue):
+    events = cameo_data.get("events", [])
+
+    # Article-level fields shared by every row of this article
+    base = {
+        "NewsID": news_id,
+        "Source": row.get("NewsSource", ""),
+        "Date": row.get("EventDate", ""),
+        "Title": one_line(row.get("Source", "")),
+        "summary": one_line(cameo_data.get("summary", "")),
+    }
+
+    # No events → write a blank row
+    if not events:
+        records = [{**base, **EMPTY_EVENT_FIELDS}]
+
+    # Write one row per event
+    else:
+        # Optional: sort events by order before writing
+        # events.sort(key=lambda x: x.get("event_order", 99))
+
+        invalid = sum(not validate(ev) for ev in events)
+        if invalid:
+            print(f"ID={news_id}: {invalid} event(s) with a code outside the CAMEO codebook")
+
+        records = [{**base, **event_fields(ev)} for ev in events]
+
+    await queue.put((news_id, records))
+
+
+async def write_group(group: List[Tuple], cameo_data: Dict, queue: asyncio.Queue, processed_ids: set):
+    # Every row sharing the coded text gets the same result
+    for _, row, news_id, _ in group:
+        await queue_article_records(row, news_id, cameo_data, queue)
+        processed_ids.add(news_id)
+
+
+async def process_batch(batch: List[List[Tuple]], queue: asyncio.Queue, processed_ids: set):
+    # batch holds groups of (idx, row, news_id, content) tuples with identical content
+    for group in batch:
+        idx, _, news_id, _ = group[0]
+        extra = f" (+{len(group) - 1} duplicate rows)" if len(group) > 1 else ""
+        print(f"Processing row {idx + 1} (ID={news_id}){extra}")
+
+    # Events (with order) and the summary for the whole batch, in one call
+    cameo_results = await get_cameo_events_batch([group[0][3] for group in batch])
+
+    for group, cameo_data in zip(batch, cameo_results):
+        await write_group(group, cameo_data, queue, processed_ids)
+
+
+async def process_rows(pending: List[Tuple], queue: asyncio.Queue, processed_ids: set):
+    # Code each distinct text once; re-indexed copies of the same story share the result
+    groups_by_hash: Dict[str, List[Tuple]] = {}
+    for item in pending:
+        content_hash = hashlib.sha1(item[3].encode("utf-8")).hexdigest()
+        groups_by_hash.setdefault(content_hash, []).append(item)
+    groups = list(groups_by_hash.values())
+
+    if USE_BATCH_API and groups:
+        groups = await process_with_batch_api(groups, queue, processed_ids)
+
+    tasks = [
+        process_batch(groups[i:i + BATCH_SIZE], queue, processed_ids)
+        for i in range(0, len(groups), BATCH_SIZE)
+    ]
+    await asyncio.gather(*tasks)
+
+
+async def main():
     if not DATA_CSV_PATH.exists():
         raise FileNotFoundError(f"Missing CSV: {DATA_CSV_PATH}")
 
-    df_input = pd.read_csv(DATA_CSV_PATH, encoding="utf-8")
+    processed_ids = load_processed_ids()
 
-    ensure_output_csv()
-    df_existing = load_existing_results()
-    processed_ids = set(df_existing.get("NewsID", []).astype(str))
+    print(f"--- Starting CAMEO extraction on {DATA_CSV_PATH} ---")
 
-    print(f"--- Starting CAMEO extraction on {len(df_input)} articles ---")
+    csv_writer = open_output_csv()
+    queue = asyncio.Queue()
+    writer = asyncio.create_task(record_writer(queue, csv_writer))
 
-    for idx, row in df_input.iterrows():
-        content = str(row.get(CONTENT_COLUMN, "")).strip()
-        news_id = str(row.get(NEWS_ID_COLUMN, "")).strip()
+    # Stream the input so memory stays bounded; with the Batch API each chunk is one batch job
+    chunk_rows = BATCH_API_MAX_REQUESTS if USE_BATCH_API else INPUT_CHUNK_ROWS
 
-        if not content:
-            print(f"Skipping row {idx}: Empty content")
-            continue
+    csv.field_size_limit(2**31 - 1)  # article bodies can exceed the 128 KB default
 
-        if news_id in processed_ids:
-            continue
+    idx = 0
+    with DATA_CSV_PATH.open(encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        while True:
+            chunk = list(itertools.islice(reader, chunk_rows))
+            if not chunk:
+                break
 
-        print(f"Processing {idx + 1}/{len(df_input)} (ID={news_id})")
-
-        # 1. Get Events (with order)
-        cameo_data = get_cameo_events_with_llm(content)
-
-        # 2. Get Summary
-        summary = get_summary_with_llm(content)
-
-        events = cameo_data.get("events", [])
-
-        # No events → write a blank row
-        if not events:
-            record = {
-                "NewsID": news_id,
-                "Source": row.get("NewsSource", ""),
-                "Date": row.get("EventDate", ""),
-                "Title": row.get("Source", ""),
-                "summary": summary,
-
-                "event_order": "",
-                "source_actor": "",
-                "target_actor": "",
-                "cameo_top_level": "",
-                "cameo_code": "",
-                "event_description": "",
-                "evidence": "",
-                "confidence": "",
-            }
-            append_record(record)
-
-        # Write one row per event
-        else:
-            # Optional: sort events by order before writing
-            # events.sort(key=lambda x: x.get("event_order", 99))
-
-            for ev in events:
-                record = {
-                    "NewsID": news_id,
-                    "Source": row.get("NewsSource", ""),
-                    "Date": row.get("EventDate", ""),
-                    "Title": row.get("Source", ""),
-                    "summary": summary,
-
-                    "event_order": ev.get("event_order", 1),  # Default to 1 if missing
-                    "source_actor": ev.get("source_actor", ""),
-                    "target_actor": ev.get("target_actor", ""),
-                    "cameo_top_level": ev.get("cameo_top_level", ""),
-                    "cameo_code": ev.get("cameo_code", ""),
-                    "event_description": ev.get("event_description", ""),
-                    "evidence": ev.get("evidence", ""),
-                    "confidence": ev.get("confidence", ""),
-                }
-                append_record(record)
+            pending = []
+            for row in chunk:
+                content = str(row.get(CONTENT_COLUMN) or "").strip()
+                news_id = str(row.get(NEWS_ID_COLUMN) or "").strip()
 
-        processed_ids.add(news_id)
+                if not content:
+                    print(f"Skipping row {idx}: Empty content")
+                elif news_id not in processed_ids:
+                    pending.append((idx, row, news_id, truncate_to_tokens(content)))
+                idx += 1
+
+            await process_rows(pending, queue, processed_ids)
+
+    await queue.put(None)
+    await writer
+    csv_writer.close()
 
-    print("\n=== CAMEO Extraction Complete ===")
+    print(f"\n=== CAMEO Extraction Complete ({idx} rows read) ===")
     print(f"CSV saved to: {OUTPUT_CSV_PATH}")
+    if truncation_stats["truncated"]:
+        print(f"{truncation_stats['truncated']} of {truncation_stats['parsed']} responses were cut off at "
+              f"max_tokens and partially recovered; consider raising max_tokens")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,11 +1,25 @@
+import asyncio
+import csv
+import functools
+import hashlib
+import importlib.util
 import json
 import os
-import time
+import random
+import sqlite3
 from pathlib import Path
-from typing import Dict, List, Optional, Callable
+from typing import Awaitable, Dict, List, Optional, Callable, Tuple
 
+import httpx
 import pandas as pd
-from openai import AzureOpenAI
+import openai
+from openai import AsyncAzureOpenAI
+
+try:
+    from orjson import dumps as orjson_dumps, loads as json_loads  # 2-5x faster on the per-response path
+except ImportError:
+    orjson_dumps = None
+    json_loads = json.loads
 
 
 # ==================== Configuration ==================== #
@@ -17,63 +31,190 @@ DATA_CSV_PATH = Path(
 )
 CONTENT_COLUMN = "Content"
 NEWS_ID_COLUMN = "NewsID"
+# The input is streamed this many rows at a time, reading only the columns used below
+INPUT_CHUNK_ROWS = 1000
+INPUT_COLUMNS = [NEWS_ID_COLUMN, CONTENT_COLUMN, "NewsSource", "EventDate", "Source"]
 
 OUTPUT_CSV_PATH = Path("CAMEO_hurriyet_Eng_1.csv")
 TOPICS_REPORT_PATH = Path("CAMEO_hurriyet_Eng_1.txt")
+CACHE_DB_PATH = Path("CAMEO_hurriyet_Eng_1_cache.sqlite")  # prompt -> response, reused across runs
 
 MAX_RETRIES = 4
 RETRY_BACKOFF_SECONDS = 5
+MAX_RETRY_WAIT_SECONDS = 60
+
+# Requests in flight at once (keep below the deployment's rate limit)
+NUM_CONCURRENT = int(os.environ.get("AZURE_OPENAI_CONCURRENCY", 16))
 
 OUTPUT_LANGUAGE = "English"
 
+# max_tokens budgets for the CAMEO event call, tried in turn: most articles fit the small one,
+# and only a response cut off at a budget is re-requested with the next
+CAMEO_MAX_TOKENS = (350, 1200)
+
 AZURE_API_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT", )
 AZURE_API_KEY = os.environ.get("AZURE_OPENAI_KEY",)
 
 if not AZURE_API_ENDPOINT or not AZURE_API_KEY:
     raise ValueError("Azure OpenAI endpoint/key missing.")
 
-client = AzureOpenAI(
+# One connection pool shared by every request; HTTP/2 multiplexes them when the h2 package is installed.
+# The read timeout leaves room for the long topic-clustering response
+http_client = httpx.AsyncClient(
+    http2=importlib.util.find_spec("h2") is not None,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    timeout=httpx.Timeout(120.0, connect=10.0),
+)
+
+client = AsyncAzureOpenAI(
     api_key=AZURE_API_KEY,
     azure_endpoint=AZURE_API_ENDPOINT,
     api_version=AZURE_API_VERSION,
+    http_client=http_client,
 )
 
 print(f"Connected to endpoint: {AZURE_API_ENDPOINT}")
 print(f"Using deployment:     {AZURE_DEPLOYMENT_NAME}")
 
+semaphore = asyncio.Semaphore(NUM_CONCURRENT)
+
 
 # ==================== Retry wrapper ==================== #
-def call_with_retries(fn: Callable, max_attempts: int = MAX_RETRIES) -> any:
+# Only these are worth retrying; anything else is a bug or a bad request and is raised at once
+TRANSIENT_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        if response.headers.get("retry-after-ms"):
+            return float(response.headers["retry-after-ms"]) / 1000.0
+        if response.headers.get("retry-after"):
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+async def call_with_retries(fn: Callable[[], Awaitable], max_attempts: int = MAX_RETRIES) -> any:
     for attempt in range(1, max_attempts + 1):
         try:
-            return fn()
-        except Exception as exc:
+            return await fn()
+        except TRANSIENT_ERRORS as exc:
             if attempt == max_attempts:
                 raise
-            wait = RETRY_BACKOFF_SECONDS * attempt
-            print(f"Attempt {attempt} failed ({exc}); retrying in {wait}s…")
-            time.sleep(wait)
+            # The server's Retry-After is exact; otherwise back off exponentially
+            wait = _retry_after(exc)
+            if wait is None:
+                wait = min(MAX_RETRY_WAIT_SECONDS, RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            wait += random.uniform(0, 0.5)  # jitter keeps concurrent requests from retrying in lockstep
+            print(f"Attempt {attempt} failed ({exc}); retrying in {wait:.1f}s…")
+            await asyncio.sleep(wait)
 
 
 def _language_clause():
     return "Respond in Turkish." if OUTPUT_LANGUAGE.lower().startswith("turk") else "Respond in English."
 
 
+# ==================== Response cache ==================== #
+def open_cache():
+    db = sqlite3.connect(CACHE_DB_PATH)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response TEXT)")
+    return db
+
+
+cache_db = open_cache()
+
+
+def cached(fn):
+    """
+    Serves fn(messages, **kwargs) from the cache. The key covers the deployment,
+    every message and the request parameters, so events, summaries and topics
+    (each with its own system prompt) are cached separately.
+    Failed calls raise and are never stored; cut-off responses are stored with
+    TRUNCATION_MARKER.
+    """
+    @functools.wraps(fn)
+    async def wrapper(messages: List[Dict], **kwargs):
+        payload = json.dumps([AZURE_DEPLOYMENT_NAME, messages, kwargs], ensure_ascii=False, sort_keys=True)
+        key = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        row = cache_db.execute("SELECT response FROM cache WHERE key = ?", (key,)).fetchone()
+        if row:
+            return row[0]
+        response = await fn(messages, **kwargs)
+        with cache_db:
+            cache_db.execute("INSERT OR REPLACE INTO cache (key, response) VALUES (?, ?)", (key, response))
+        return response
+    return wrapper
+
+
 # ==================== Azure OpenAI wrapper ==================== #
-def run_chat_completion(messages: List[Dict], **kwargs):
-    def api_call():
-        response = client.chat.completions.create(
-            model=AZURE_DEPLOYMENT_NAME,
-            messages=messages,
-            **kwargs,
-        )
-        return response.choices[0].message.content
-    return call_with_retries(api_call)
+# Prompt tokens billed vs. served from the automatic prompt cache (identical prefixes of 1024+ tokens)
+usage_stats = {"prompt_tokens": 0, "cached_tokens": 0}
+# max_tokens -> [calls, responses cut off at that budget]; used to tune CAMEO_MAX_TOKENS
+budget_stats: Dict[int, List[int]] = {}
+
+
+# Prefixed to a response that stopped at max_tokens. It is cached like any other response, so a rerun
+# neither re-pays for a budget that was already too small nor for a last budget that was cut off too
+TRUNCATION_MARKER = "<<truncated>>"
+
+
+def split_truncation(content: str) -> Tuple[str, bool]:
+    """Returns (content without the marker, whether it was cut off)."""
+    if content.startswith(TRUNCATION_MARKER):
+        return content[len(TRUNCATION_MARKER):], True
+    return content, False
+
+
+@cached
+async def run_chat_completion(messages: List[Dict], **kwargs):
+    async def api_call():
+        async with semaphore:
+            response = await client.chat.completions.create(
+                model=AZURE_DEPLOYMENT_NAME,
+                messages=messages,
+                **kwargs,
+            )
+        if response.usage:
+            details = response.usage.prompt_tokens_details
+            usage_stats["prompt_tokens"] += response.usage.prompt_tokens
+            usage_stats["cached_tokens"] += (details.cached_tokens or 0) if details else 0
+        choice = response.choices[0]
+        if choice.finish_reason == "length":
+            return TRUNCATION_MARKER + (choice.message.content or "")
+        return choice.message.content
+    return await call_with_retries(api_call)
+
+
+async def run_within_budgets(messages: List[Dict], budgets: Tuple[int, ...], **kwargs) -> str:
+    """
+    Tries each max_tokens budget in turn, moving on only when the response was cut off.
+    The last budget's response is returned even if it was cut off too, still carrying
+    TRUNCATION_MARKER (see split_truncation).
+    """
+    for max_tokens in budgets:
+        stats = budget_stats.setdefault(max_tokens, [0, 0])
+        stats[0] += 1
+        content = await run_chat_completion(messages, max_tokens=max_tokens, **kwargs)
+        if not content.startswith(TRUNCATION_MARKER):
+            return content
+        stats[1] += 1
+    return content
 
 
 # ==================== CAMEO EVENT EXTRACTION ==================== #
-def get_cameo_events_with_llm(text_content: str) -> Dict:
-    system_prompt = f"""
+# Module constant (no per-call interpolation) so every request starts with the same prefix
+# and Azure OpenAI can serve it from its prompt cache; the response language goes in the user message
+CAMEO_SYSTEM_PROMPT = """
 You are an automated political event coder using the CAMEO 1.1b3 ontology.
 You MUST output valid JSON only. (Azure requirement)
 
@@ -130,13 +271,13 @@ GENERAL RULES
   - event_description
   - evidence (direct quotation)
   - confidence (0.0–1.0)
-- If no events, output {{"events": []}}.
+- If no events, output {"events": []}.
 
 Output format:
 
-{{
+{
   "events": [
-    {{
+    {
       "source_actor": "",
       "target_actor": "",
       "cameo_top_level": "",
@@ -144,71 +285,118 @@ Output format:
       "event_description": "",
       "evidence": "",
       "confidence": 0.0
-    }}
+    }
   ]
-}}
-
-If NONE → {{"events": []}}
-
-
-You MUST output valid JSON only. {_language_clause()}
-    """
-
+}
+
+If NONE → {"events": []}
+
+
+You MUST output valid JSON only.
+"""
+
+
+# Structured Outputs: responses always match this schema, and cameo_top_level can only be "01".."20"
+CAMEO_EVENTS_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "cameo_events",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "events": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "source_actor": {"type": "string"},
+                            "target_actor": {"type": "string"},
+                            "cameo_top_level": {"type": "string", "enum": [f"{i:02d}" for i in range(1, 21)]},
+                            "cameo_code": {"type": "string"},
+                            "event_description": {"type": "string"},
+                            "evidence": {"type": "string"},
+                            "confidence": {"type": "number"},
+                        },
+                        "required": [
+                            "source_actor", "target_actor", "cameo_top_level", "cameo_code",
+                            "event_description", "evidence", "confidence",
+                        ],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["events"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+async def get_cameo_events_with_llm(text_content: str) -> Dict:
     try:
-        content = run_chat_completion(
+        content = await run_within_budgets(
             [
-                {"role": "system", "content": system_prompt},
-                {"role": "assistant", "content": "I will output JSON as instructed."},
-                {"role": "user", "content": text_content}
+                {"role": "system", "content": CAMEO_SYSTEM_PROMPT},
+                {"role": "user", "content": f"{_language_clause()}\n\n{text_content}"}
             ],
-            response_format={"type": "json_object"},
+            CAMEO_MAX_TOKENS,
+            response_format=CAMEO_EVENTS_FORMAT,
             temperature=0.0,
-            max_tokens=900,
         )
-        return json.loads(content)
+        content, truncated = split_truncation(content)
+        if truncated:
+            # Cut-off structured output is not valid JSON; the article gets a blank row
+            return {"events": [], "error": f"response cut off at max_tokens={CAMEO_MAX_TOKENS[-1]}"}
+        return json_loads(content)
 
     except Exception as exc:
         return {"events": [], "error": str(exc)}
 
 
 # ===================== OPTIONAL SUMMARY ===================== #
-def get_summary_with_llm(text_content: str) -> str:
+async def get_summary_with_llm(text_content: str) -> str:
     system_prompt = f"You are an expert political analyst. Produce a 120-word summary. {_language_clause()}"
 
     try:
-        out = run_chat_completion(
+        out = await run_within_budgets(
             [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": text_content}
             ],
+            (250,),  # a 120-word summary; a cut-off one is still kept
             temperature=0.3,
-            max_tokens=250,
         )
-        return out.strip()
+        return split_truncation(out)[0].strip()
     except Exception as exc:
         return f"Error: {exc}"
 
 
 # ===================== TOPIC EXTRACTION ===================== #
-def get_topics_for_single_doc_llm(text_content: str) -> List[str]:
-    system_prompt = f"Extract 2–3 very short noun-phrase topics. {_language_clause()}"
+async def get_topics_for_single_doc_llm(text_content: str) -> List[str]:
+    system_prompt = (
+        f"Extract 2–3 very short noun-phrase topics. {_language_clause()} "
+        'Output JSON only: {"topics": ["...", "..."]}'
+    )
 
     try:
-        out = run_chat_completion(
+        out = await run_chat_completion(
             [
                 {"role": "system", "content": system_prompt},
-                {"role": "assistant", "content": "I will output JSON topics."},
                 {"role": "user", "content": text_content}
             ],
             response_format={"type": "json_object"},
             temperature=0.0,
         )
-        return json.loads(out).get("topics", [])
+        out, truncated = split_truncation(out)
+        if truncated:
+            return ["Error: response cut off at max_tokens"]
+        return json_loads(out).get("topics", [])
     except Exception as exc:
         return [f"Error: {exc}"]
 
 
-def cluster_topics_with_llm(all_topics_list: List[List[str]]) -> str:
+async def cluster_topics_with_llm(all_topics_list: List[List[str]]) -> str:
     flat = [t for lst in all_topics_list for t in lst if not str(t).startswith("Error")]
     if not flat:
         return "No topics available."
@@ -216,15 +404,15 @@ def cluster_topics_with_llm(all_topics_list: List[List[str]]) -> str:
     prompt = f"Cluster these into 5–7 themes and describe them: {', '.join(flat)}. {_language_clause()}"
 
     try:
-        out = run_chat_completion(
+        out = await run_within_budgets(
             [
                 {"role": "system", "content": "You are a theme clustering engine."},
                 {"role": "user", "content": prompt}
             ],
+            (700,),
             temperature=0.3,
-            max_tokens=700,
         )
-        return out.strip()
+        return split_truncation(out)[0].strip()
     except Exception as exc:
         return f"Error: {exc}"
 
@@ -250,74 +438,89 @@ OUTPUT_COLUMNS = [
 ]
 
 
-def ensure_output_csv():
-    if not OUTPUT_CSV_PATH.exists():
-        pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(
-            OUTPUT_CSV_PATH,
-            index=False,
-            encoding="utf-8-sig"
-        )
+def open_output_csv():
+    # One handle for the whole run; the header is written only for a new file
+    new_file = not OUTPUT_CSV_PATH.exists()
+    f = OUTPUT_CSV_PATH.open("a", encoding="utf-8-sig", newline="")
+    writer = csv.DictWriter(f, fieldnames=OUTPUT_COLUMNS)
+    if new_file:
+        writer.writeheader()
+        f.flush()
+    return f, writer
+
+
+def json_dumps(value):
+    # Non-ASCII is kept as is, like json.dumps(..., ensure_ascii=False)
+    if orjson_dumps is None:
+        return json.dumps(value, ensure_ascii=False)
+    return orjson_dumps(value).decode("utf-8")
 
 
 def load_existing_results():
     if OUTPUT_CSV_PATH.exists():
-        return pd.read_csv(OUTPUT_CSV_PATH, encoding="utf-8-sig")
+        # Same dtype/NA options as the input, so NewsIDs compare equal ("0123" stays "0123", not 123)
+        return pd.read_csv(OUTPUT_CSV_PATH, encoding="utf-8-sig", dtype=str, keep_default_na=False)
     return pd.DataFrame(columns=OUTPUT_COLUMNS)
 
 
-def append_record(record):
-    pd.DataFrame([record], columns=OUTPUT_COLUMNS).to_csv(
-        OUTPUT_CSV_PATH,
-        mode="a",
-        header=not OUTPUT_CSV_PATH.exists(),
-        index=False,
-        encoding="utf-8-sig"
-    )
+def _topics_or_empty(item):
+    try:
+        return json_loads(item) if item else []
+    except json.JSONDecodeError:
+        return []
 
 
 def topics_from_results(df):
-    topics = []
-    col = df.get("document_topics_json", [])
-
-    for item in col.fillna("[]"):
-        try:
-            topics.append(json.loads(item))
-        except:
-            topics.append([])
-    return topics
+    # One topic list per article (articles with several events span several rows)
+    if "NewsID" in df:
+        df = df.drop_duplicates("NewsID")
+    col = df.get("document_topics_json", pd.Series(dtype=str))
+    return col.fillna("[]").map(_topics_or_empty).tolist()
 
 
 # ===================== MAIN ===================== #
-def main():
+async def main():
     if not DATA_CSV_PATH.exists():
         raise FileNotFoundError(f"Missing CSV: {DATA_CSV_PATH}")
 
-    df_input = pd.read_csv(DATA_CSV_PATH, encoding="utf-8")
+    # dtype=str skips type inference; keep_default_na=False reads blank cells as ""
+    reader = pd.read_csv(
+        DATA_CSV_PATH,
+        encoding="utf-8",
+        chunksize=INPUT_CHUNK_ROWS,
+        usecols=lambda column: column in INPUT_COLUMNS,
+        dtype=str,
+        keep_default_na=False,
+    )
 
-    ensure_output_csv()
+    output_file, writer = open_output_csv()
     df_existing = load_existing_results()
     processed_ids = set(df_existing.get("NewsID", []).astype(str))
 
     all_topics = topics_from_results(df_existing)
 
-    print(f"--- Starting CAMEO extraction on {len(df_input)} articles ---")
+    print(f"--- Starting CAMEO extraction on {DATA_CSV_PATH.name} ---")
 
-    for idx, row in df_input.iterrows():
+    async def process_row(idx, row):
         content = str(row.get(CONTENT_COLUMN, "")).strip()
         news_id = str(row.get(NEWS_ID_COLUMN, "")).strip()
 
         if not content:
             print(f"Skipping row {idx}: Empty content")
-            continue
+            return
 
         if news_id in processed_ids:
-            continue
+            return
+        processed_ids.add(news_id)  # claimed now so a duplicate row running concurrently is skipped
 
-        print(f"Processing {idx+1}/{len(df_input)} (ID={news_id})")
+        print(f"Processing row {idx+1} (ID={news_id})")
 
-        cameo_data = get_cameo_events_with_llm(content)
-        summary = get_summary_with_llm(content)
-        doc_topics = get_topics_for_single_doc_llm(content)
+        # The three prompts are independent; the semaphore still bounds requests in flight
+        cameo_data, summary, doc_topics = await asyncio.gather(
+            get_cameo_events_with_llm(content),
+            get_summary_with_llm(content),
+            get_topics_for_single_doc_llm(content),
+        )
         all_topics.append(doc_topics)
 
         events = cameo_data.get("events", [])
@@ -340,9 +543,9 @@ def main():
                 "confidence": "",
 
                 "document_topics": ", ".join(doc_topics),
-                "document_topics_json": json.dumps(doc_topics, ensure_ascii=False),
+                "document_topics_json": json_dumps(doc_topics),
             }
-            append_record(record)
+            writer.writerow(record)
 
         # Write one row per event
         else:
@@ -363,24 +566,30 @@ def main():
                     "confidence": ev.get("confidence", ""),
 
                     "document_topics": ", ".join(doc_topics),
-                    "document_topics_json": json.dumps(doc_topics, ensure_ascii=False),
+                    "document_topics_json": json_dumps(doc_topics),
                 }
-                append_record(record)
+                writer.writerow(record)
 
-        processed_ids.add(news_id)
+        output_file.flush()  # one write per article, so finished articles survive an interrupted run
 
-    # Final topic clustering
-    final_df = pd.read_csv(OUTPUT_CSV_PATH, encoding="utf-8-sig")
-    all_topics = topics_from_results(final_df)
+    # Articles of a chunk run concurrently (bounded by the semaphore); records are appended as each finishes
+    for chunk in reader:
+        # to_dict("records") converts the chunk column-wise, without a Series or namedtuple per row
+        await asyncio.gather(*(process_row(idx, row) for idx, row in zip(chunk.index, chunk.to_dict("records"))))
+    output_file.close()
 
+    # Final topic clustering (all_topics already holds the earlier runs' topics plus this run's)
     print("\n--- Clustering topics ---")
-    clusters = cluster_topics_with_llm(all_topics)
+    clusters = await cluster_topics_with_llm(all_topics)
     TOPICS_REPORT_PATH.write_text(clusters, encoding="utf-8")
 
     print("\n=== CAMEO Extraction Complete ===")
     print(f"CSV saved to: {OUTPUT_CSV_PATH}")
     print(f"Topic report: {TOPICS_REPORT_PATH}")
+    print(f"Prompt tokens: {usage_stats['prompt_tokens']} ({usage_stats['cached_tokens']} from the prompt cache)")
+    for max_tokens, (calls, cut_off) in sorted(budget_stats.items()):
+        print(f"max_tokens={max_tokens}: {cut_off}/{calls} responses cut off")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
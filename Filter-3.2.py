@@ -1,152 +1,252 @@
-import json
-import os
+import argparse
+import asyncio
+import csv
 import pandas as pd
 from pathlib import Path
-from openai import OpenAI  # Changed import
 from tqdm import tqdm
 
-# ==================== CONFIGURATION ==================== #
+# Models, retries, caching, the keyword gate and the Batch API are shared by the Filter-3.x scripts
+from filter_common import (
+    ARTICLES_PER_REQUEST,
+    BATCH_MAX_REQUESTS,
+    ISRAEL_PATTERN,
+    TURKEY_PATTERN,
+    RelevanceFilter,
+    clip_content,
+    is_uncertain,
+    parse_relevance,
+    usage_stats,
+)
 
-# Standard OpenAI Model (e.g., "gpt-4o", "gpt-4-turbo")
-OPENAI_MODEL = "gpt-4.1"
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# ==================== CONFIGURATION ==================== #
 
 # Update path to your file
 DATA_CSV_PATH = Path(r"C:\Users\Soos\PycharmProjects\CAMEO\Secon_filter\Dunya_Tur2.csv")
 OUTPUT_CSV_PATH = Path("Dunya2_filter2_results2_OpenAI.csv")
 
-# ==================== CLIENT SETUP ==================== #
+# OpenAI Batch API input files (run with --online for direct calls)
+BATCH_INPUT_PATH = Path("Dunya2_filter2_batch_input2.jsonl")
 
-if not OPENAI_API_KEY:
-    raise ValueError("Please set your OPENAI_API_KEY environment variable.")
+# The input is streamed in chunks of this many rows (one Batch API job per chunk without --online),
+# reading only the columns used below
+INPUT_CHUNK_ROWS = 1000
+INPUT_COLUMNS = {"NewsID", "Date", "Title", "Content"}
 
-# Initialize Standard OpenAI Client
-client = OpenAI(
-    api_key=OPENAI_API_KEY
-)
+# Article content is clipped to this many tokens
+MAX_CONTENT_TOKENS = 3000
 
+# Results are appended as they finish; rows whose ID is already in the output are skipped on a rerun
+ID_COLUMN = "NewsID"
+OUTPUT_COLUMNS = ["NewsID", "Date", "Title", "Is_Relevant", "Reason_English", "Content_Snippet"]
 
 # ==================== CAMEO ANALYSIS FUNCTION ==================== #
 
-def check_cameo_relevance(title, content):
-    """
-    Analyzes if the article contains a CAMEO event between Israel and Turkey.
-    Forces output in English even if text is Turkish.
-    """
-
-    # 1. System Prompt: Sets the Persona + Language Constraint
-    system_prompt = (
-        "You are an expert political event coder specializing in the CAMEO and expertise in Turkish"
-        "(Conflict and Mediation Event Observations) framework. "
-        "You must determine if a valid interaction exists between two specific state actors. "
-        "IMPORTANT: Regardless of the language of the input article (Turkish, English, or Hebrew), "
-        "your output JSON and reasoning must ALWAYS be in ENGLISH."
-    )
+# Static prompts are module constants and the article goes last, so every request shares the
+# same prefix for OpenAI prompt caching
+# 1. System Prompt: Sets the Persona + Language Constraint
+CAMEO_SYSTEM_PROMPT = (
+    "You are an expert political event coder specializing in the CAMEO and expertise in Turkish"
+    "(Conflict and Mediation Event Observations) framework. "
+    "You must determine if a valid interaction exists between two specific state actors. "
+    "IMPORTANT: Regardless of the language of the input article (Turkish, English, or Hebrew), "
+    "your output JSON and reasoning must ALWAYS be in ENGLISH."
+)
+
+# 2. Detailed Task (part of the static system message): Defines CAMEO rules for Israel <-> Turkey
+CAMEO_TASK_PROMPT = """
+--- TASK ---
+Analyze the article in the user message and determine if it describes a CAMEO event involving BOTH 'Turkey' (TUR) and 'Israel' (ISR).
+
+To be 'relevant' (true), the text must describe an action taken by Turkey affecting Israel, OR an action taken by Israel affecting Turkey.
+
+Use these 4 CAMEO 'Quad' categories to decide:
+1. Verbal Cooperation: (e.g., Turkey praises Israel, Israel expresses regret to Turkey, Diplomats meet, Agree to negotiate).
+2. Material Cooperation: (e.g., Israel delivers drones to Turkey, Trade agreements, Joint military drills, Providing aid).
+3. Verbal Conflict: (e.g., Erdogan criticizes Peres, Israel condemns Turkish TV series, Ambassadors summoned for protest).
+4. Material Conflict: (e.g., Expelling diplomats, Canceling military exercises, Seizing ships, Military engagement).
+
+--- EXCLUSION RULES (Result = false) ---
+- Ignore articles where both countries are just mentioned but do not interact (e.g., "US officials visited Israel and Turkey").
+- Ignore articles about the Israel-Palestine conflict unless Turkey explicitly reacts or intervenes.
+"""
 
-    # 2. Detailed User Prompt: Defines CAMEO rules for Israel <-> Turkey
-    user_prompt = f"""
-    Title: {title}
-    Content: {content[:15000]}
+# 3. Single-article output format. Kept out of the shared system message, which multi-article
+# requests reuse with their own format
+CAMEO_OUTPUT_FORMAT = """
+--- OUTPUT FORMAT ---
+Respond with this JSON object only:
+{
+  "is_relevant": true/false,
+  "reason": "Identify the specific CAMEO action in ENGLISH (e.g., 'Verbal Conflict: Erdogan criticized Israel at Davos').",
+  "confidence": 0.0-1.0
+}
+"""
 
-    --- TASK ---
-    Analyze the text above and determine if it describes a CAMEO event involving BOTH 'Turkey' (TUR) and 'Israel' (ISR).
 
-    To be 'relevant' (true), the text must describe an action taken by Turkey affecting Israel, OR an action taken by Israel affecting Turkey.
+CAMEO_SYSTEM_MESSAGE = CAMEO_SYSTEM_PROMPT + "\n" + CAMEO_TASK_PROMPT
 
-    Use these 4 CAMEO 'Quad' categories to decide:
-    1. Verbal Cooperation: (e.g., Turkey praises Israel, Israel expresses regret to Turkey, Diplomats meet, Agree to negotiate).
-    2. Material Cooperation: (e.g., Israel delivers drones to Turkey, Trade agreements, Joint military drills, Providing aid).
-    3. Verbal Conflict: (e.g., Erdogan criticizes Peres, Israel condemns Turkish TV series, Ambassadors summoned for protest).
-    4. Material Conflict: (e.g., Expelling diplomats, Canceling military exercises, Seizing ships, Military engagement).
 
-    --- EXCLUSION RULES (Result = false) ---
-    - Ignore articles where both countries are just mentioned but do not interact (e.g., "US officials visited Israel and Turkey").
-    - Ignore articles about the Israel-Palestine conflict unless Turkey explicitly reacts or intervenes.
+def cameo_relevance_messages(title, content):
+    user_prompt = f"Title: {title}\nContent: {content}"
 
-    --- OUTPUT FORMAT ---
-    Respond with this JSON object only:
-    {{
-      "is_relevant": true/false,
-      "reason": "Identify the specific CAMEO action in ENGLISH (e.g., 'Verbal Conflict: Erdogan criticized Israel at Davos')."
-    }}
-    """
+    return [
+        {"role": "system", "content": CAMEO_SYSTEM_MESSAGE + CAMEO_OUTPUT_FORMAT},
+        {"role": "user", "content": user_prompt}
+    ]
 
-    try:
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,  # Use standard model name
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0
-        )
 
-        result = json.loads(response.choices[0].message.content)
-        return result.get("is_relevant", False), result.get("reason", "No reason provided")
+relevance = RelevanceFilter(cameo_relevance_messages, CAMEO_SYSTEM_MESSAGE, BATCH_INPUT_PATH)
 
-    except Exception as e:
-        return False, f"LLM Error: {str(e)}"
+
+# ==================== OUTPUT ==================== #
+
+def load_processed_ids():
+    if not OUTPUT_CSV_PATH.exists():
+        return set()
+    done = pd.read_csv(OUTPUT_CSV_PATH, encoding="utf-8-sig", usecols=[ID_COLUMN], dtype=str, keep_default_na=False)
+    return set(done[ID_COLUMN])
+
+
+def open_output_csv():
+    # One handle for the whole run; the header is written only for a new file
+    new_file = not OUTPUT_CSV_PATH.exists()
+    f = OUTPUT_CSV_PATH.open("a", encoding="utf-8-sig", newline="")
+    writer = csv.DictWriter(f, fieldnames=OUTPUT_COLUMNS)
+    if new_file:
+        writer.writeheader()
+        f.flush()
+    return f, writer
 
 
 # ==================== MAIN LOOP ==================== #
 
-def main():
+async def main(online=False):
     if not DATA_CSV_PATH.exists():
         print(f"File not found: {DATA_CSV_PATH}")
         return
 
-    # Load Data
+    # Load Data (streamed; dtype=str skips type inference, keep_default_na=False reads blanks as "")
     print("Loading Data...")
-    try:
-        df = pd.read_csv(DATA_CSV_PATH, encoding="utf-8-sig")
-    except UnicodeDecodeError:
-        df = pd.read_csv(DATA_CSV_PATH, encoding="utf-8")
-
-    df = df.fillna("")
-
-    # Strip whitespace from headers to avoid "Date " issues
-    df.columns = df.columns.str.strip()
-
-    print(f"Analyzing {len(df)} articles for CAMEO events...")
-    results = []
+    reader = pd.read_csv(
+        DATA_CSV_PATH,
+        encoding="utf-8-sig",
+        chunksize=INPUT_CHUNK_ROWS if online else BATCH_MAX_REQUESTS,
+        usecols=lambda column: column.strip() in INPUT_COLUMNS,
+        dtype=str,
+        keep_default_na=False,
+    )
 
-    for index, row in tqdm(df.iterrows(), total=len(df)):
+    print(f"Analyzing articles in {DATA_CSV_PATH.name} for CAMEO events...")
+    processed_ids = load_processed_ids()
+    if processed_ids:
+        print(f"Resuming: {len(processed_ids)} articles already in {OUTPUT_CSV_PATH}")
+    output_file, writer = open_output_csv()
+    progress = tqdm(unit="article")
+    # Running totals for the summary; records go straight to the CSV
+    analyzed = relevant = 0
+    samples = []
+    gate_misses = 0
+
+    def build_record(index, row, is_relevant, reason):
         title = str(row.get('Title', ''))
         content = str(row.get('Content', ''))
 
-        # Call the new CAMEO function
-        is_relevant, reason = check_cameo_relevance(title, content)
-
         # Safe extraction of Date using .get()
-        results.append({
+        return {
             "NewsID": row.get('NewsID', index),
             "Date": row.get('Date', ''),
             "Title": title,
             "Is_Relevant": is_relevant,
             "Reason_English": reason,
             "Content_Snippet": content[:150]
-        })
-
-    # Save to CSV
-    results_df = pd.DataFrame(results)
-    results_df.to_csv(OUTPUT_CSV_PATH, index=False, encoding="utf-8-sig")
+        }
+
+    async def analyze_group(group, batch_results, gated_out):
+        # Rows the Batch API answered are used as is; the rest share one multi-article request
+        verdicts, todo = {}, []
+        for index, row in group:
+            if index in gated_out:
+                verdicts[index] = (False, "keyword_gate_miss", 1.0)
+                continue
+            try:
+                verdicts[index] = parse_relevance(batch_results[str(index)])
+            except (KeyError, ValueError):
+                todo.append((index, row))
+
+        if todo:
+            checked = await relevance.check_batch(
+                [(str(row.get('Title', '')), str(row.get('Content', ''))) for _, row in todo]
+            )
+            verdicts.update(zip((index for index, _ in todo), checked))
+
+        # Only the uncertain verdicts pay for the full model
+        uncertain = [(index, row) for index, row in group if is_uncertain(verdicts[index])]
+        if uncertain:
+            rechecked = await asyncio.gather(*(
+                relevance.escalate(str(row.get('Title', '')), str(row.get('Content', '')), verdicts[index])
+                for index, row in uncertain
+            ))
+            verdicts.update(zip((index for index, _ in uncertain), rechecked))
+
+        records = [build_record(index, row, *verdicts[index][:2]) for index, row in group]
+        writer.writerows(records)
+        output_file.flush()  # finished groups survive an interrupted run
+        progress.update(len(group))
+        return records
+
+    for df in reader:
+        # Strip whitespace from headers to avoid "Date " issues
+        df.columns = df.columns.str.strip()
+        if ID_COLUMN in df:
+            df = df[~df[ID_COLUMN].isin(processed_ids)].copy()
+            if df.empty:
+                continue
+        # Clipped once per row; prompts, cache keys and embeddings all use the clipped text
+        df["Content"] = df["Content"].map(lambda content: clip_content(content, MAX_CONTENT_TOKENS))
+
+        # Articles that do not name both sides cannot be relevant and skip the LLM
+        text = df.get("Title", "") + "\n" + df["Content"]
+        passed = text.str.contains(ISRAEL_PATTERN) & text.str.contains(TURKEY_PATTERN)
+        gated_out = set(df.index[~passed])
+        gate_misses += len(gated_out)
+
+        # Batch API first; anything it did not answer goes through the online path below
+        batch_results = {} if online else await relevance.run_batch(df[passed])
+
+        # Groups are analyzed concurrently (bounded by the semaphore); gather keeps input order.
+        # to_dict("records") converts the chunk column-wise, without a Series or namedtuple per row
+        rows = list(zip(df.index, df.to_dict("records")))
+        groups = [rows[i:i + ARTICLES_PER_REQUEST] for i in range(0, len(rows), ARTICLES_PER_REQUEST)]
+        for records in await asyncio.gather(*(analyze_group(group, batch_results, gated_out) for group in groups)):
+            analyzed += len(records)
+            for record in records:
+                if record['Is_Relevant'] == True:
+                    relevant += 1
+                    if len(samples) < 5:
+                        samples.append(record)
+
+    progress.close()
+    output_file.close()
 
     print("\n" + "=" * 40)
     print("CAMEO ANALYSIS COMPLETE")
-    print(f"Total Relevant Events: {results_df['Is_Relevant'].sum()}")
+    print(f"Total Relevant Events (this run): {relevant}")
+    print(f"Skipped by the keyword gate: {gate_misses}")
     print(f"Results saved to: {OUTPUT_CSV_PATH}")
+    print(f"Prompt tokens: {usage_stats['prompt_tokens']} ({usage_stats['cached_tokens']} from the prompt cache)")
     print("=" * 40)
 
-    if not results_df.empty:
+    if analyzed:
         print("\n--- Sample CAMEO Results ---")
-        # Ensure we filter boolean correctly
-        relevant_rows = results_df[results_df['Is_Relevant'] == True]
-        if not relevant_rows.empty:
-            print(relevant_rows[['Title', 'Reason_English']].head(5))
+        if samples:
+            print(pd.DataFrame(samples)[['Title', 'Reason_English']])
         else:
             print("No relevant events found.")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Filter articles for CAMEO events between Israel and Turkey.")
+    parser.add_argument("--online", action="store_true",
+                        help="call the API directly instead of the Batch API (small/debug runs)")
+    args = parser.parse_args()
+    asyncio.run(main(online=args.online))
@@ -1,168 +1,268 @@
-import json
-import os
+import argparse
+import asyncio
+import csv
 import pandas as pd
 from pathlib import Path
-from openai import OpenAI  # Changed import
 from tqdm import tqdm
 
-# ==================== CONFIGURATION ==================== #
+# Models, retries, caching, the keyword gate and the Batch API are shared by the Filter-3.x scripts
+from filter_common import (
+    ARTICLES_PER_REQUEST,
+    BATCH_MAX_REQUESTS,
+    ISRAEL_PATTERN,
+    TURKEY_PATTERN,
+    RelevanceFilter,
+    clip_content,
+    is_uncertain,
+    parse_relevance,
+    usage_stats,
+)
 
-# Standard OpenAI Model (e.g., "gpt-4o", "gpt-4-turbo")
-OPENAI_MODEL = "gpt-4.1"
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# ==================== CONFIGURATION ==================== #
 
 # Update path to your file
 DATA_CSV_PATH = Path(r"C:\Users\Soos\PycharmProjects\CAMEO\Secon_filter\Dunya_Tur2.csv")
 OUTPUT_CSV_PATH = Path("Dunya2_filter2_results3_OpenAI.csv")
 
-# ==================== CLIENT SETUP ==================== #
+# OpenAI Batch API input files (run with --online for direct calls)
+BATCH_INPUT_PATH = Path("Dunya2_filter2_batch_input3.jsonl")
 
-if not OPENAI_API_KEY:
-    raise ValueError("Please set your OPENAI_API_KEY environment variable.")
+# The input is streamed in chunks of this many rows (one Batch API job per chunk without --online),
+# reading only the columns used below
+INPUT_CHUNK_ROWS = 1000
+INPUT_COLUMNS = {"NewsID", "Date", "Title", "Content"}
 
-# Initialize Standard OpenAI Client
-client = OpenAI(
-    api_key=OPENAI_API_KEY
-)
+# Article content is clipped to this many tokens
+MAX_CONTENT_TOKENS = 3000
 
+# Results are appended as they finish; rows whose ID is already in the output are skipped on a rerun
+ID_COLUMN = "NewsID"
+OUTPUT_COLUMNS = ["NewsID", "Date", "Title", "Is_Relevant", "Reason", "Content_Snippet"]
 
 # ==================== BROAD ANALYSIS FUNCTION ==================== #
 
-def analyze_broad_relevance(title, content):
-    """
-    Analyzes if the article contains ANY meaningful connection (Political, Economic, Social)
-    between Israel and Turkey.
-    """
-
-    # 1. System Prompt: Multilingual Analyst
-    system_prompt = (
-        "You are an expert international relations analyst fluent in English, Turkish, and Hebrew. "
-        "Your task is to analyze news articles for connections between Israel and Turkey. "
-        "IMPORTANT: regardless of the language of the input article (Turkish, English, or Hebrew), "
-        "your output JSON and reasoning must ALWAYS be in ENGLISH."
-    )
+# Static prompts are module constants and the article goes last, so every request shares the
+# same prefix for OpenAI prompt caching
+# 1. System Prompt: Multilingual Analyst
+BROAD_SYSTEM_PROMPT = (
+    "You are an expert international relations analyst fluent in English, Turkish, and Hebrew. "
+    "Your task is to analyze news articles for connections between Israel and Turkey. "
+    "IMPORTANT: regardless of the language of the input article (Turkish, English, or Hebrew), "
+    "your output JSON and reasoning must ALWAYS be in ENGLISH."
+)
+
+# 2. Broad Task (part of the static system message)
+BROAD_TASK_PROMPT = """
+--- TASK ---
+Analyze the article in the user message and determine if there is a **connection, interaction, or relationship** involving BOTH 'Turkey' and 'Israel'.
+
+Use a **BROAD** definition of relevance. If the news falls into ANY of the following categories, mark it as relevant (true):
+
+1. **Diplomatic & Political:**
+   - Official meetings, treaties, or agreements.
+   - Tensions, condemnations, or praise between leaders (e.g., Erdogan, Netanyahu, Peres).
+   - Appointment or summoning of ambassadors.
+
+2. **Economic & Business:**
+   - Trade deals, energy pipelines, tourism trends.
+   - Business investments or corporate cooperation between the two nations.
 
-    # 2. Broad User Prompt
-    user_prompt = f"""
-    Title: {title}
-    Content: {content[:15000]}
+3. **Military & Security:**
+   - Arms sales (e.g., drones, tanks), joint military exercises, or intelligence sharing.
+   - Security cooperation or conflict.
 
-    --- TASK ---
-    Analyze the text above and determine if there is a **connection, interaction, or relationship** involving BOTH 'Turkey' and 'Israel'.
+4. **Social, Public & Cultural:**
+   - Public protests in Turkey regarding Israel (or vice versa).
+   - Cultural events, TV series controversies, or media disputes.
+   - News regarding the Jewish community in Turkey.
+   - NGO activities (e.g., Aid flotillas like Mavi Marmara).
 
-    Use a **BROAD** definition of relevance. If the news falls into ANY of the following categories, mark it as relevant (true):
+5. **Indirect/Mediation:**
+   - Turkey acting as a mediator for Israel (e.g., Israel-Syria talks).
+   - Israel's reaction to Turkish foreign policy.
 
-    1. **Diplomatic & Political:**
-       - Official meetings, treaties, or agreements.
-       - Tensions, condemnations, or praise between leaders (e.g., Erdogan, Netanyahu, Peres).
-       - Appointment or summoning of ambassadors.
+--- EXCLUSION RULES (Result = false) ---
+- Exclude articles where the two countries are merely listed together in a generic list (e.g., "Tourists visited Greece, Turkey, and Israel").
+"""
 
-    2. **Economic & Business:**
-       - Trade deals, energy pipelines, tourism trends.
-       - Business investments or corporate cooperation between the two nations.
+# 3. Single-article output format. Kept out of the shared system message, which multi-article
+# requests reuse with their own format
+BROAD_OUTPUT_FORMAT = """
+--- OUTPUT FORMAT ---
+Respond with this JSON object only:
+{
+  "is_relevant": true/false,
+  "reason": "A concise sentence in ENGLISH explaining why it was filtered IN or OUT.",
+  "confidence": 0.0-1.0
+}
+"""
 
-    3. **Military & Security:**
-       - Arms sales (e.g., drones, tanks), joint military exercises, or intelligence sharing.
-       - Security cooperation or conflict.
 
-    4. **Social, Public & Cultural:**
-       - Public protests in Turkey regarding Israel (or vice versa).
-       - Cultural events, TV series controversies, or media disputes.
-       - News regarding the Jewish community in Turkey.
-       - NGO activities (e.g., Aid flotillas like Mavi Marmara).
+BROAD_SYSTEM_MESSAGE = BROAD_SYSTEM_PROMPT + "\n" + BROAD_TASK_PROMPT
 
-    5. **Indirect/Mediation:**
-       - Turkey acting as a mediator for Israel (e.g., Israel-Syria talks).
-       - Israel's reaction to Turkish foreign policy.
 
-    --- EXCLUSION RULES (Result = false) ---
-    - Exclude articles where the two countries are merely listed together in a generic list (e.g., "Tourists visited Greece, Turkey, and Israel").
+def broad_relevance_messages(title, content):
+    user_prompt = f"Title: {title}\nContent: {content}"
 
-    --- OUTPUT FORMAT ---
-    Respond with this JSON object only:
-    {{
-      "is_relevant": true/false,
-      "reason": "A concise sentence in ENGLISH explaining why it was filtered IN or OUT."
-    }}
-    """
+    return [
+        {"role": "system", "content": BROAD_SYSTEM_MESSAGE + BROAD_OUTPUT_FORMAT},
+        {"role": "user", "content": user_prompt}
+    ]
 
-    try:
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,  # Use standard model name
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0
-        )
 
-        result = json.loads(response.choices[0].message.content)
-        return result.get("is_relevant", False), result.get("reason", "No reason provided")
+relevance = RelevanceFilter(broad_relevance_messages, BROAD_SYSTEM_MESSAGE, BATCH_INPUT_PATH)
 
-    except Exception as e:
-        return False, f"LLM Error: {str(e)}"
+
+# ==================== OUTPUT ==================== #
+
+def load_processed_ids():
+    if not OUTPUT_CSV_PATH.exists():
+        return set()
+    done = pd.read_csv(OUTPUT_CSV_PATH, encoding="utf-8-sig", usecols=[ID_COLUMN], dtype=str, keep_default_na=False)
+    return set(done[ID_COLUMN])
+
+
+def open_output_csv():
+    # One handle for the whole run; the header is written only for a new file
+    new_file = not OUTPUT_CSV_PATH.exists()
+    f = OUTPUT_CSV_PATH.open("a", encoding="utf-8-sig", newline="")
+    writer = csv.DictWriter(f, fieldnames=OUTPUT_COLUMNS)
+    if new_file:
+        writer.writeheader()
+        f.flush()
+    return f, writer
 
 
 # ==================== MAIN LOOP ==================== #
 
-def main():
+async def main(online=False):
     if not DATA_CSV_PATH.exists():
         print(f"File not found: {DATA_CSV_PATH}")
         return
 
-    # Load Data
+    # Load Data (streamed; dtype=str skips type inference, keep_default_na=False reads blanks as "")
     print("Loading Data...")
-    # Using utf-8-sig to handle Turkish characters and potential BOM from Excel
-    try:
-        df = pd.read_csv(DATA_CSV_PATH, encoding="utf-8-sig")
-    except UnicodeDecodeError:
-        df = pd.read_csv(DATA_CSV_PATH, encoding="utf-8")  # Fallback
-
-    df = df.fillna("")
-
-    # Strip whitespace from column names to avoid "Date " vs "Date" issues
-    df.columns = df.columns.str.strip()
-
-    print(f"Analyzing {len(df)} articles for broad Israel-Turkey connections...")
-    results = []
+    reader = pd.read_csv(
+        DATA_CSV_PATH,
+        encoding="utf-8-sig",
+        chunksize=INPUT_CHUNK_ROWS if online else BATCH_MAX_REQUESTS,
+        usecols=lambda column: column.strip() in INPUT_COLUMNS,
+        dtype=str,
+        keep_default_na=False,
+    )
 
-    for index, row in tqdm(df.iterrows(), total=len(df)):
+    print(f"Analyzing articles in {DATA_CSV_PATH.name} for broad Israel-Turkey connections...")
+    processed_ids = load_processed_ids()
+    if processed_ids:
+        print(f"Resuming: {len(processed_ids)} articles already in {OUTPUT_CSV_PATH}")
+    output_file, writer = open_output_csv()
+    progress = tqdm(unit="article")
+    # Running totals for the summary; records go straight to the CSV
+    analyzed = relevant = 0
+    samples = []
+    gate_misses = 0
+
+    def build_record(index, row, is_relevant, reason):
         title = str(row.get('Title', ''))
         content = str(row.get('Content', ''))
 
-        is_relevant, reason = analyze_broad_relevance(title, content)
-
         # FIXED LINE BELOW: Changed row['Data'] to row.get('Date', '')
-        results.append({
+        return {
             "NewsID": row.get('NewsID', index),
             "Date": row.get('Date', ''),
             "Title": title,
             "Is_Relevant": is_relevant,
             "Reason": reason,
             "Content_Snippet": content[:150]
-        })
-
-    # Save to CSV
-    results_df = pd.DataFrame(results)
-    results_df.to_csv(OUTPUT_CSV_PATH, index=False, encoding="utf-8-sig")
+        }
+
+    async def analyze_group(group, batch_results, gated_out):
+        # Rows the Batch API answered are used as is; the rest share one multi-article request
+        verdicts, todo = {}, []
+        for index, row in group:
+            if index in gated_out:
+                verdicts[index] = (False, "keyword_gate_miss", 1.0)
+                continue
+            try:
+                verdicts[index] = parse_relevance(batch_results[str(index)])
+            except (KeyError, ValueError):
+                todo.append((index, row))
+
+        if todo:
+            checked = await relevance.check_batch(
+                [(str(row.get('Title', '')), str(row.get('Content', ''))) for _, row in todo]
+            )
+            verdicts.update(zip((index for index, _ in todo), checked))
+
+        # Only the uncertain verdicts pay for the full model
+        uncertain = [(index, row) for index, row in group if is_uncertain(verdicts[index])]
+        if uncertain:
+            rechecked = await asyncio.gather(*(
+                relevance.escalate(str(row.get('Title', '')), str(row.get('Content', '')), verdicts[index])
+                for index, row in uncertain
+            ))
+            verdicts.update(zip((index for index, _ in uncertain), rechecked))
+
+        records = [build_record(index, row, *verdicts[index][:2]) for index, row in group]
+        writer.writerows(records)
+        output_file.flush()  # finished groups survive an interrupted run
+        progress.update(len(group))
+        return records
+
+    for df in reader:
+        # Strip whitespace from column names to avoid "Date " vs "Date" issues
+        df.columns = df.columns.str.strip()
+        if ID_COLUMN in df:
+            df = df[~df[ID_COLUMN].isin(processed_ids)].copy()
+            if df.empty:
+                continue
+        # Clipped once per row; prompts, cache keys and embeddings all use the clipped text
+        df["Content"] = df["Content"].map(lambda content: clip_content(content, MAX_CONTENT_TOKENS))
+
+        # Articles that do not name both sides cannot be relevant and skip the LLM
+        text = df.get("Title", "") + "\n" + df["Content"]
+        passed = text.str.contains(ISRAEL_PATTERN) & text.str.contains(TURKEY_PATTERN)
+        gated_out = set(df.index[~passed])
+        gate_misses += len(gated_out)
+
+        # Batch API first; anything it did not answer goes through the online path below
+        batch_results = {} if online else await relevance.run_batch(df[passed])
+
+        # Groups are analyzed concurrently (bounded by the semaphore); gather keeps input order.
+        # to_dict("records") converts the chunk column-wise, without a Series or namedtuple per row
+        rows = list(zip(df.index, df.to_dict("records")))
+        groups = [rows[i:i + ARTICLES_PER_REQUEST] for i in range(0, len(rows), ARTICLES_PER_REQUEST)]
+        for records in await asyncio.gather(*(analyze_group(group, batch_results, gated_out) for group in groups)):
+            analyzed += len(records)
+            for record in records:
+                if record['Is_Relevant'] == True:
+                    relevant += 1
+                    if len(samples) < 5:
+                        samples.append(record)
+
+    progress.close()
+    output_file.close()
 
     print("\n" + "=" * 40)
     print("ANALYSIS COMPLETE")
-    print(f"Total Relevant Articles: {results_df['Is_Relevant'].sum()}")
+    print(f"Total Relevant Articles (this run): {relevant}")
+    print(f"Skipped by the keyword gate: {gate_misses}")
     print(f"Results saved to: {OUTPUT_CSV_PATH}")
+    print(f"Prompt tokens: {usage_stats['prompt_tokens']} ({usage_stats['cached_tokens']} from the prompt cache)")
     print("=" * 40)
 
     # Show a few examples
-    if not results_df.empty:
+    if analyzed:
         print("\n--- Examples of Reasoning ---")
-        # Filter for relevant=True to show meaningful examples
-        relevant_df = results_df[results_df['Is_Relevant'] == True]
-        if not relevant_df.empty:
-            print(relevant_df[['Title', 'Reason']].head(5))
+        if samples:
+            print(pd.DataFrame(samples)[['Title', 'Reason']])
         else:
             print("No relevant articles found.")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Filter articles for broad Israel-Turkey connections.")
+    parser.add_argument("--online", action="store_true",
+                        help="call the API directly instead of the Batch API (small/debug runs)")
+    args = parser.parse_args()
+    asyncio.run(main(online=args.online))
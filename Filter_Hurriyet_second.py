@@ -1,8 +1,27 @@
+import asyncio
+import functools
+import hashlib
 import json
 import os
+import random
+import re
+import sqlite3
+from collections import OrderedDict
 from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import openai
 import pandas as pd
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
+
+try:
+    import ahocorasick  # pyahocorasick: one pass over the text for all keywords
+except ImportError:
+    ahocorasick = None
+
+try:
+    import polars as pl  # multithreaded Rust regex for the column-wise keyword step
+except ImportError:
+    pl = None
 
 
 # ==================== CONFIG ==================== #
@@ -14,10 +33,26 @@ DATA_CSV_PATH = Path(
 )
 CONTENT_COLUMN = "Content"
 NEWS_ID_COLUMN = "NewsID"
+# The input is streamed this many rows at a time; each chunk's results are appended to the outputs
+INPUT_CHUNK_ROWS = 1000
 
 KEYWORD_FILTER_OUTPUT = Path("hurriyet_Eng_keyword_filtered_articles_2.csv")
 FINAL_FILTER_OUTPUT = Path("hurriyet_Eng_filtered_relevant_articles_2.csv")
 DEBUG_OUTPUT = Path("hurriyet_filter_debug_2.csv")
+CACHE_DB_PATH = Path("hurriyet_filter_2_cache.sqlite")  # prompt -> response, reused across runs
+
+MAX_RETRIES = 4
+RETRY_BACKOFF_SECONDS = 5
+MAX_RETRY_WAIT_SECONDS = 60
+
+# LLM requests in flight at once (keep below the deployment's rate limit)
+NUM_CONCURRENT = int(os.environ.get("AZURE_OPENAI_CONCURRENCY", 16))
+# Keyword matches judged per LLM request (amortizes the system prompt over several articles)
+ARTICLES_PER_REQUEST = 10
+# Article text sent to the LLM (the lead carries the signal); the keyword step still scans everything
+LLM_MAX_CHARS = 4000
+# Keyword verdicts remembered for repeated article texts (wire copies, re-scraped pages)
+KEYWORD_CACHE_SIZE = 50_000
 
 AZURE_API_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT",)
 AZURE_API_KEY = os.environ.get("AZURE_OPENAI_KEY", )
@@ -25,7 +60,7 @@ AZURE_API_KEY = os.environ.get("AZURE_OPENAI_KEY", )
 if not AZURE_API_ENDPOINT or not AZURE_API_KEY:
     raise ValueError("Azure OpenAI endpoint/key missing.")
 
-client = AzureOpenAI(
+client = AsyncAzureOpenAI(
     api_key=AZURE_API_KEY,
     azure_endpoint=AZURE_API_ENDPOINT,
     api_version=AZURE_API_VERSION,
@@ -33,113 +68,317 @@ client = AzureOpenAI(
 
 print("Connected to Azure.")
 
+semaphore = asyncio.Semaphore(NUM_CONCURRENT)
+
+
+# ================================================================
+# RETRY WRAPPER
+# ================================================================
+# Only these are worth retrying; anything else is a bug or a bad request and is raised at once
+TRANSIENT_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        if response.headers.get("retry-after-ms"):
+            return float(response.headers["retry-after-ms"]) / 1000.0
+        if response.headers.get("retry-after"):
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+async def call_with_retries(fn: Callable[[], Awaitable], max_attempts: int = MAX_RETRIES) -> any:
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await fn()
+        except TRANSIENT_ERRORS as exc:
+            if attempt == max_attempts:
+                raise
+            # The server's Retry-After is exact; otherwise back off exponentially
+            wait = _retry_after(exc)
+            if wait is None:
+                wait = min(MAX_RETRY_WAIT_SECONDS, RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            wait += random.uniform(0, 0.5)  # jitter keeps concurrent requests from retrying in lockstep
+            print(f"Attempt {attempt} failed ({exc}); retrying in {wait:.1f}s…")
+            await asyncio.sleep(wait)
+
+
+# ================================================================
+# RESPONSE CACHE (temperature 0, so a repeated prompt gets the stored answer)
+# ================================================================
+def open_cache():
+    db = sqlite3.connect(CACHE_DB_PATH)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response TEXT)")
+    return db
+
+
+cache_db = open_cache()
+
+
+def cache_key(messages):
+    payload = json.dumps([AZURE_DEPLOYMENT_MINI, messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cache_get(key):
+    row = cache_db.execute("SELECT response FROM cache WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def cache_put_many(items):
+    with cache_db:
+        cache_db.executemany("INSERT OR REPLACE INTO cache (key, response) VALUES (?, ?)", items)
+
+
+def cached(fn):
+    """
+    Serves fn(messages) from the cache, keyed on the deployment and every message.
+    Failed calls raise and are never stored.
+    """
+    @functools.wraps(fn)
+    async def wrapper(messages):
+        key = cache_key(messages)
+        response = cache_get(key)
+        if response is None:
+            response = await fn(messages)
+            cache_put_many([(key, response)])
+        return response
+    return wrapper
+
+
+@cached
+async def run_chat_completion(messages):
+    # A rate limit or timeout is retried here, so it doesn't reach the filters' except and drop the article
+    async def api_call():
+        async with semaphore:
+            response = await client.chat.completions.create(
+                model=AZURE_DEPLOYMENT_MINI,
+                messages=messages,
+                response_format={"type": "json_object"},
+                temperature=0
+            )
+        return response.choices[0].message.content
+    return await call_with_retries(api_call)
+
 
 # ================================================================
 # STEP 1 — EXPANDED MULTILINGUAL KEYWORD FILTER
 # ================================================================
-def cheap_keyword_filter(text: str) -> bool:
-    if not text:
-        return False
+# ENGLISH / TURKISH / HEBREW KEYWORDS
+ISRAEL_KEYWORDS = [
+    "israel", "israeli", "jerusalem", "gaza", "idf", "netanyahu", "herzog", "sharon",
+    "israil", "israilli", "kudüs", "gazze",
+    "ישראל", "ישראלי", "עזה", "ירושלים", "צה\"ל",
+]
+TURKEY_KEYWORDS = [
+    "turkey", "turkish", "türkiye", "ankara", "istanbul", "erdogan", "erdoğan", "akp",
+    "türk",
+    "טורקיה", "טורקי", "איסטנבול", "ארדואן",
+]
+
+# ADD POLITICAL → to catch high‑level relations
+POLITICAL_TERMS = [
+    "prime minister", "president", "foreign minister", "diplomat",
+    "cabinet", "government", "minister",
+    "başbakan", "cumhurbaşkanı",           # Turkish
+    "ראש הממשלה", "שר החוץ", "משרד החוץ"  # Hebrew
+]
+
+# re.IGNORECASE treats i, I, İ and ı as one letter, but str.lower() turns "İ" into "i̇" and Rust's (?i)
+# keeps "ı" apart. So the keywords and, on the automaton/Polars paths, the text are folded to "i" first;
+# the result is then the same whichever optional package is installed
+I_VARIANTS = "İIı"
+I_FOLD = str.maketrans(dict.fromkeys(I_VARIANTS, "i"))
+
+
+def fold_case(text: str) -> str:
+    return text.translate(I_FOLD).lower()
+
+
+KEYWORD_GROUPS = tuple(
+    (group, [fold_case(k) for k in keywords])
+    for group, keywords in (("israel", ISRAEL_KEYWORDS), ("turkey", TURKEY_KEYWORDS), ("political", POLITICAL_TERMS))
+)
 
-    t = text.lower()
 
-    # ENGLISH KEYWORDS
-    israel_en = ["israel", "israeli", "jerusalem", "gaza", "idf",
-                 "netanyahu", "herzog", "sharon"]
-    turkey_en = ["turkey", "turkish", "türkiye", "ankara", "istanbul",
-                 "erdogan", "erdoğan", "akp"]
+def at_word_start(keyword: str) -> bool:
+    # English/Turkish keywords must start a word ("idf" not inside "tidfor") but may take suffixes
+    # ("Israelis", "İsrail'e", "Türkler"); Hebrew attaches prefixes (ב, ל, ה...) so it matches anywhere
+    return not any("\u0590" <= c <= "\u05ff" for c in keyword)
 
-    # TURKISH
-    israel_tr = ["israil", "israilli", "kudüs", "gazze"]
-    turkey_tr = ["türkiye", "türk", "ankara", "istanbul", "erdoğan"]
 
-    # HEBREW
-    israel_he = ["ישראל", "ישראלי", "עזה", "ירושלים", "צה\"ל"]
-    turkey_he = ["טורקיה", "טורקי", "איסטנבול", "ארדואן"]
+def build_keyword_automaton():
+    # One automaton for all three lists; each keyword's payload is (group, length, word-start only)
+    automaton = ahocorasick.Automaton()
+    for group, keywords in KEYWORD_GROUPS:
+        for keyword in keywords:
+            automaton.add_word(keyword, (group, len(keyword), at_word_start(keyword)))
+    automaton.make_automaton()
+    return automaton
 
-    # ADD POLITICAL → to catch high‑level relations
-    political_terms = [
-        "prime minister", "president", "foreign minister", "diplomat",
-        "cabinet", "government", "minister",
-        "başbakan", "cumhurbaşkanı",           # Turkish
-        "ראש הממשלה", "שר החוץ", "משרד החוץ"  # Hebrew
-    ]
 
-    has_israel = any(k in t for k in israel_en + israel_tr + israel_he)
-    has_turkey = any(k in t for k in turkey_en + turkey_tr + turkey_he)
-    has_political = any(k in t for k in political_terms)
+KEYWORD_AUTOMATON = build_keyword_automaton() if ahocorasick else None
+
+# Without pyahocorasick: one compiled alternation per group, longest keywords first.
+# Case-insensitive, so the text is never lowercased or folded
+KEYWORD_PATTERNS = [
+    re.compile(
+        "|".join(
+            (r"\b" if at_word_start(k) else "") + re.escape(k) for k in sorted(keywords, key=len, reverse=True)
+        ),
+        re.IGNORECASE,
+    )
+    for _, keywords in KEYWORD_GROUPS
+]
+ISRAEL_PATTERN, TURKEY_PATTERN, POLITICAL_PATTERN = KEYWORD_PATTERNS
+
 
-    # Rules:
-    if has_israel and has_turkey:
-        return True
+# Keyed on a digest of the text, so the remembered verdicts don't hold the article texts themselves
+keyword_verdicts = OrderedDict()
 
-    # One side + political words (important for diplomacy coverage)
-    if has_political and (has_israel or has_turkey):
-        return True
 
+def cheap_keyword_filter(text: str) -> bool:
+    if not text:
+        return False
+
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    verdict = keyword_verdicts.get(key)
+    if verdict is None:
+        verdict = keyword_verdicts[key] = scan_keywords(text)
+        if len(keyword_verdicts) > KEYWORD_CACHE_SIZE:
+            keyword_verdicts.popitem(last=False)
+    else:
+        keyword_verdicts.move_to_end(key)
+    return verdict
+
+
+def scan_keywords(text: str) -> bool:
+    # Rules: Israel + Turkey, or one side + political words (important for diplomacy coverage).
+    # Either way that is two different groups, so the scan stops at the second one
+    if KEYWORD_AUTOMATON is None:
+        # Hürriyet mentions Turkey almost everywhere, so the rare groups are tested first
+        if ISRAEL_PATTERN.search(text):
+            return bool(TURKEY_PATTERN.search(text) or POLITICAL_PATTERN.search(text))
+        return bool(POLITICAL_PATTERN.search(text) and TURKEY_PATTERN.search(text))
+
+    t = fold_case(text)  # the automaton matches the folded keywords exactly
+    found = set()
+    for end, (group, length, word_start) in KEYWORD_AUTOMATON.iter(t):
+        start = end - length + 1
+        if word_start and start > 0 and (t[start - 1].isalnum() or t[start - 1] == "_"):
+            continue  # inside another word
+        found.add(group)
+        if len(found) >= 2:
+            return True
     return False
 
 
+def column_contains(contents: pd.Series, pattern: re.Pattern) -> pd.Series:
+    """contents.str.contains(pattern), run by Polars when it is installed."""
+    if pl is None:
+        return contents.str.contains(pattern)
+    # (?i) handles the other letters; the i variants are folded like the keywords (see I_VARIANTS).
+    # The dtype is explicit because an empty selection would otherwise come out as a null column
+    values = pl.Series(contents.tolist(), dtype=pl.String).str.replace_all(f"[{I_VARIANTS}]", "i")
+    return pd.Series(values.str.contains("(?i)" + pattern.pattern).to_list(), index=contents.index, dtype=bool)
+
+
+def keyword_filter_column(contents: pd.Series) -> pd.Series:
+    """cheap_keyword_filter over a whole column, as a boolean Series."""
+    if KEYWORD_AUTOMATON is not None:
+        return contents.map(cheap_keyword_filter).astype(bool)
+
+    has_israel = column_contains(contents, ISRAEL_PATTERN)
+    has_political = column_contains(contents, POLITICAL_PATTERN)
+    # Turkey only decides rows that already have one of the rarer groups; the rest are never scanned for it
+    undecided = has_israel | has_political
+    has_turkey = pd.Series(False, index=contents.index)
+    has_turkey[undecided] = column_contains(contents[undecided], TURKEY_PATTERN)
+    return (has_israel & (has_turkey | has_political)) | (has_political & has_turkey)
+
+
 # ================================================================
 # STEP 2 — MINI LLM FILTER (CHEAP)
 # ================================================================
-def llm_relevance_filter(text: str) -> bool:
-    """
-    Returns True if article is specifically about Israel interacting with Turkey.
-    """
+RELEVANCE_SYSTEM_PROMPT = (
+    "You are a multilingual relevance classifier. "
+    "You MUST output valid JSON only. "
+    "You understand English, Hebrew, and Turkish.\n\n"
+    "Your task is to determine whether an article is specifically about "
+    "Israel interacting with Turkey, or Turkey interacting with Israel.\n\n"
+    "Definition of 'interaction':\n"
+    "- diplomacy, negotiations, agreements\n"
+    "- political or military cooperation\n"
+    "- conflict, disputes, sanctions, threats\n"
+    "- trade, economic relations, joint initiatives\n"
+    "- official statements by one state explicitly about the other\n"
+    "- actions by leaders, ministers, embassies, diplomats, or institutions "
+    "of one country directly concerning the other country\n\n"
+    "NOT considered interaction (must be classified as not relevant):\n"
+    "- incidental mentions of Turkey or Israel\n"
+    "- author/official titles like 'Israel's ambassador to Turkey'\n"
+    "- articles about Gaza, Hamas, the UN, or other topics without Israel–Turkey interaction\n"
+    "- travel, geography, ethnicity, or background references\n"
+    "- historical context that includes either country without bilateral engagement\n\n"
+    "When in doubt, answer false.\n\n"
+    "Output ONLY JSON in the form: {\"relevant\": true} or {\"relevant\": false}"
+)
 
-    messages = [
-        {
-            "role": "system",
-            "content": (
-                "You are a multilingual relevance classifier. "
-                "You MUST output valid JSON only. "
-                "You understand English, Hebrew, and Turkish.\n\n"
-                "Your task is to determine whether an article is specifically about "
-                "Israel interacting with Turkey, or Turkey interacting with Israel.\n\n"
-                "Definition of 'interaction':\n"
-                "- diplomacy, negotiations, agreements\n"
-                "- political or military cooperation\n"
-                "- conflict, disputes, sanctions, threats\n"
-                "- trade, economic relations, joint initiatives\n"
-                "- official statements by one state explicitly about the other\n"
-                "- actions by leaders, ministers, embassies, diplomats, or institutions "
-                "of one country directly concerning the other country\n\n"
-                "NOT considered interaction (must be classified as not relevant):\n"
-                "- incidental mentions of Turkey or Israel\n"
-                "- author/official titles like 'Israel's ambassador to Turkey'\n"
-                "- articles about Gaza, Hamas, the UN, or other topics without Israel–Turkey interaction\n"
-                "- travel, geography, ethnicity, or background references\n"
-                "- historical context that includes either country without bilateral engagement\n\n"
-                "When in doubt, answer false.\n\n"
-                "Output ONLY JSON in the form: {\"relevant\": true} or {\"relevant\": false}"
-            )
-        },
+# Replaces the single-article output format when several articles share one request
+MULTI_ARTICLE_FORMAT = (
+    "\n\nWhen the user message holds several numbered articles, judge EACH one on its own and "
+    "output ONLY JSON in the form: {\"results\": [{\"id\": 1, \"relevant\": true/false}, ...]} "
+    "with exactly one entry per article, \"id\" being the article's number."
+)
+
+
+def relevance_messages(text: str) -> List[Dict]:
+    return [
+        {"role": "system", "content": RELEVANCE_SYSTEM_PROMPT},
         {
             "role": "user",
             "content": (
                 "Determine if this article is about Israel interacting with Turkey, "
                 "or Turkey interacting with Israel.\n"
                 "Respond ONLY in json: {\"relevant\": true/false}\n\n"
-                f"Article:\n{text}"
+                f"Article:\n{text[:LLM_MAX_CHARS]}"
             )
         }
     ]
 
-    # Your model call here:
-    # response = client.chat.completions.create( ... )
-    # Then parse response.json()["relevant"]
+
+def relevance_batch_messages(texts: List[str]) -> List[Dict]:
+    articles = "\n---\n".join(f"Article {n}:\n{text[:LLM_MAX_CHARS]}" for n, text in enumerate(texts, 1))
+    return [
+        {"role": "system", "content": RELEVANCE_SYSTEM_PROMPT + MULTI_ARTICLE_FORMAT},
+        {
+            "role": "user",
+            "content": (
+                "Determine for each article whether it is about Israel interacting with Turkey, "
+                "or Turkey interacting with Israel.\n\n"
+                f"{articles}"
+            )
+        }
+    ]
 
 
+async def llm_relevance_filter(text: str) -> bool:
+    """
+    Returns True if article is specifically about Israel interacting with Turkey.
+    """
     try:
-        response = client.chat.completions.create(
-            model=AZURE_DEPLOYMENT_MINI,
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=0
-        )
-
-        result = json.loads(response.choices[0].message.content)
+        result = json.loads(await run_chat_completion(relevance_messages(text)))
         return result.get("relevant", False)
 
     except Exception as e:
@@ -147,71 +386,115 @@ def llm_relevance_filter(text: str) -> bool:
         return False
 
 
+async def llm_relevance_filter_batch(items: List[Tuple[Any, str]]) -> Dict[Any, bool]:
+    """
+    Judges several (id, text) articles with one request and returns {id: relevant}.
+    Articles already cached on their own are answered from the cache; an article missing
+    from the response, or in a request that failed, is checked on its own.
+    """
+    results = {}
+    pending = []
+    for item_id, text in items:
+        response = cache_get(cache_key(relevance_messages(text)))
+        if response is None:
+            pending.append((item_id, text))
+            continue
+        try:
+            results[item_id] = json.loads(response).get("relevant", False)
+        except json.JSONDecodeError:
+            pending.append((item_id, text))
+
+    if len(pending) > 1:
+        try:
+            response = await run_chat_completion(relevance_batch_messages([text for _, text in pending]))
+            answered = []
+            for entry in json.loads(response).get("results", []):
+                n = int(entry.get("id", 0)) - 1
+                if 0 <= n < len(pending) and pending[n][0] not in results:
+                    item_id, text = pending[n]
+                    results[item_id] = bool(entry.get("relevant", False))
+                    answered.append((cache_key(relevance_messages(text)), json.dumps({"relevant": results[item_id]})))
+            # Stored per article, so later runs hit the cache however the articles are grouped
+            cache_put_many(answered)
+        except Exception as e:
+            print(f"LLM filter err for {len(pending)} articles ({e}); checking them one by one")
+
+    missing = [(item_id, text) for item_id, text in pending if item_id not in results]
+    singles = await asyncio.gather(*(llm_relevance_filter(text) for _, text in missing))
+    results.update(zip((item_id for item_id, _ in missing), singles))
+    return results
+
+
 # ================================================================
 # MAIN FILTERING PIPELINE (NOW SAVES EVERYTHING)
 # ================================================================
-def main():
-    if not DATA_CSV_PATH.exists():
-        raise FileNotFoundError(f"CSV not found: {DATA_CSV_PATH}")
-
-    df = pd.read_csv(DATA_CSV_PATH, encoding="utf-8")
-    print(f"Loaded {len(df)} articles.\n")
-
-    keyword_filtered_rows = []
-    final_filtered_rows = []
-    debug_records = []     # Full dataset with yes/no columns
-
-    for idx, row in df.iterrows():
-        content = str(row.get(CONTENT_COLUMN, "")).strip()
-        news_id = row.get(NEWS_ID_COLUMN)
-
-        print(f"--- Article {idx+1}/{len(df)} (ID={news_id}) ---")
+def append_csv(df: pd.DataFrame, path: Path):
+    # Header only when the file is new; earlier chunks of this run are already in it
+    df.to_csv(path, mode="a", header=not path.exists(), index=False, encoding="utf-8-sig")
 
-        # STEP 1
-        keyword_pass = cheap_keyword_filter(content)
-        print("Keyword filter:", keyword_pass)
 
-        # STEP 2
-        llm_pass = False
-        if keyword_pass:
-            llm_pass = llm_relevance_filter(content)
-            print("LLM filter:", llm_pass)
-        else:
-            print("Skipping LLM filter (keyword failed).")
-
-        # RECORD FOR DEBUG CSV
-        debug_records.append({
-            **row.to_dict(),
-            "keyword_pass": "yes" if keyword_pass else "no",
-            "llm_pass": "yes" if llm_pass else "no",
-        })
-
-        # Save matches
-        if keyword_pass:
-            keyword_filtered_rows.append(row)
+async def main():
+    if not DATA_CSV_PATH.exists():
+        raise FileNotFoundError(f"CSV not found: {DATA_CSV_PATH}")
 
-        if keyword_pass and llm_pass:
-            final_filtered_rows.append(row)
+    # Every run rewrites its outputs
+    for path in (DEBUG_OUTPUT, KEYWORD_FILTER_OUTPUT, FINAL_FILTER_OUTPUT):
+        path.unlink(missing_ok=True)
+
+    total = keyword_total = final_total = 0
+
+    for df in pd.read_csv(DATA_CSV_PATH, encoding="utf-8", chunksize=INPUT_CHUNK_ROWS):
+        # STEP 1 (cheap, column-wise)
+        contents = df[CONTENT_COLUMN].fillna("").astype(str).str.strip()
+        keyword_pass = keyword_filter_column(contents)
+
+        # STEP 2 — only keyword matches, ARTICLES_PER_REQUEST per request; requests run concurrently.
+        # Articles whose LLM input (the first LLM_MAX_CHARS) is identical are judged once and share the verdict
+        llm_inputs = contents[keyword_pass].str[:LLM_MAX_CHARS]
+        unique_inputs = llm_inputs.drop_duplicates()
+        candidates = list(zip(unique_inputs.index, unique_inputs))
+        batches = [candidates[i:i + ARTICLES_PER_REQUEST] for i in range(0, len(candidates), ARTICLES_PER_REQUEST)]
+        llm_results = {}
+        for verdicts in await asyncio.gather(*(llm_relevance_filter_batch(batch) for batch in batches)):
+            llm_results.update(verdicts)
+        verdict_by_input = {text: llm_results.get(idx, False) for idx, text in candidates}
+        llm_pass = llm_inputs.map(verdict_by_input).reindex(df.index, fill_value=False).astype(bool)
+
+        # RECORD FOR DEBUG CSV (the whole chunk with yes/no columns) and save matches
+        append_csv(
+            df.assign(
+                keyword_pass=keyword_pass.map({True: "yes", False: "no"}),
+                llm_pass=llm_pass.map({True: "yes", False: "no"}),
+            ),
+            DEBUG_OUTPUT,
+        )
+        keyword_filtered_rows = df[keyword_pass]
+        final_filtered_rows = df[keyword_pass & llm_pass]
+        if not keyword_filtered_rows.empty:
+            append_csv(keyword_filtered_rows, KEYWORD_FILTER_OUTPUT)
+        if not final_filtered_rows.empty:
+            append_csv(final_filtered_rows, FINAL_FILTER_OUTPUT)
+
+        total += len(df)
+        keyword_total += len(keyword_filtered_rows)
+        final_total += len(final_filtered_rows)
+        print(f"{total} articles: {keyword_total} keyword matches, {final_total} LLM-confirmed")
 
     # SAVE DEBUG (all articles)
-    df_debug = pd.DataFrame(debug_records)
-    df_debug.to_csv(DEBUG_OUTPUT, index=False, encoding="utf-8-sig")
     print(f"\nSaved full debug log to: {DEBUG_OUTPUT}")
 
     # STEP 1 OUTPUT
-    if keyword_filtered_rows:
-        pd.DataFrame(keyword_filtered_rows).to_csv(KEYWORD_FILTER_OUTPUT, index=False, encoding="utf-8-sig")
-        print(f"Saved {len(keyword_filtered_rows)} keyword-filtered articles to: {KEYWORD_FILTER_OUTPUT}")
+    if keyword_total:
+        print(f"Saved {keyword_total} keyword-filtered articles to: {KEYWORD_FILTER_OUTPUT}")
     else:
         print("No keyword matches.")
 
     # STEP 2 OUTPUT
-    if final_filtered_rows:
-        pd.DataFrame(final_filtered_rows).to_csv(FINAL_FILTER_OUTPUT, index=False, encoding="utf-8-sig")
-        print(f"Saved {len(final_filtered_rows)} LLM-confirmed relevant articles to: {FINAL_FILTER_OUTPUT}")
+    if final_total:
+        print(f"Saved {final_total} LLM-confirmed relevant articles to: {FINAL_FILTER_OUTPUT}")
     else:
         print("No LLM-confirmed relevant articles.")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,12 +1,27 @@
+import asyncio
+import functools
 import json
+import logging
 import os
-import time
-import re
+import random
+import sys
+from logging.handlers import MemoryHandler
 from pathlib import Path
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, Optional
 
+import openai
 import pandas as pd
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+try:
+    from orjson import loads as json_loads  # 2-3x faster than the stdlib parser
+except ImportError:
+    json_loads = json.loads
+
+try:
+    from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+except ImportError:  # the hand-rolled loop in retry_transient backs off the same way
+    retry = None
 
 # ==================== Configuration ==================== #
 # Recommended models: "gpt-4o", "gpt-4-turbo", or "gpt-3.5-turbo-0125"
@@ -15,28 +30,46 @@ OPENAI_MODEL_NAME = "gpt-4.1"
 DATA_CSV_PATH = Path("ThemarkerHebrew.csv")
 CONTENT_COLUMN = "Content"
 NEWS_ID_COLUMN = "NewsID"
+# The input is streamed this many rows at a time
+INPUT_CHUNK_ROWS = 1000
 
 # Optional Input Columns
 SOURCE_COLUMN = "Source"
 DATE_COLUMN = "Date"
 TITLE_COLUMN = "Title"
+# Only these columns are parsed from the input; the others are never used
+INPUT_COLUMNS = {NEWS_ID_COLUMN, CONTENT_COLUMN, SOURCE_COLUMN, DATE_COLUMN, TITLE_COLUMN}
 
 OUTPUT_CSV_PATH = Path("Societal_Sentiment_Israel_OpenAI.csv")
+# Finished records are appended to the CSV in batches of this size (and at the end of every input chunk)
+OUTPUT_FLUSH_ROWS = 100
 
 OUTPUT_LANGUAGE = "English"
 
 MAX_RETRIES = 4
-RETRY_BACKOFF_SECONDS = 5
+# Randomized exponential backoff bounds, so concurrent requests don't retry in lockstep
+RETRY_WAIT_MIN_SECONDS = 1
+RETRY_WAIT_MAX_SECONDS = 30
+
+# Requests in flight at once (raise/lower to match your account's rate limits)
+NUM_CONCURRENT = int(os.environ.get("OPENAI_CONCURRENCY", 16))
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable missing.")
 
+# Progress goes to stderr in bursts of 100 lines instead of one write per line; warnings are written at once
+logger = logging.getLogger("societal_sentiment")
+logger.setLevel(logging.INFO)
+logger.addHandler(MemoryHandler(100, flushLevel=logging.WARNING, target=logging.StreamHandler(sys.stderr)))
+
 # Initialize Standard OpenAI Client
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+logger.info(f"Using OpenAI Model: {OPENAI_MODEL_NAME}")
 
-print(f"Using OpenAI Model: {OPENAI_MODEL_NAME}")
+semaphore = asyncio.Semaphore(NUM_CONCURRENT)
 
 
 # ==================== Helpers ==================== #
@@ -44,23 +77,39 @@ def _language_clause():
     return "Respond in Turkish." if OUTPUT_LANGUAGE.lower().startswith("turk") else "Respond in English."
 
 
-def call_with_retries(fn: Callable, max_attempts: int = MAX_RETRIES) -> Any:
-    for attempt in range(1, max_attempts + 1):
-        try:
-            return fn()
-        except Exception as exc:
-            # Basic error handling
-            error_str = str(exc)
-            if "429" in error_str:
-                print("Rate limit exceeded. Retrying...")
-
-            if attempt == max_attempts:
-                print(f"Final failure: {exc}")
-                raise
-
-            wait = RETRY_BACKOFF_SECONDS * attempt
-            print(f"Attempt {attempt} failed; retrying in {wait}s…")
-            time.sleep(wait)
+# Only rate limits, connection errors/timeouts and 5xx are retried; bad requests fail immediately
+TRANSIENT_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def _log_retry(attempt: int, exc: BaseException, wait: float) -> None:
+    logger.warning(f"Attempt {attempt} failed ({exc}); retrying in {wait:.1f}s…")
+
+
+if retry is not None:
+    retry_transient = retry(
+        stop=stop_after_attempt(MAX_RETRIES),
+        wait=wait_random_exponential(min=RETRY_WAIT_MIN_SECONDS, max=RETRY_WAIT_MAX_SECONDS),
+        retry=retry_if_exception_type(TRANSIENT_ERRORS),
+        before_sleep=lambda state: _log_retry(
+            state.attempt_number, state.outcome.exception(), state.next_action.sleep
+        ),
+        reraise=True,
+    )
+else:
+    def retry_transient(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(1, MAX_RETRIES + 1):
+                try:
+                    return await fn(*args, **kwargs)
+                except TRANSIENT_ERRORS as exc:
+                    if attempt == MAX_RETRIES:
+                        raise
+                    high = min(RETRY_WAIT_MAX_SECONDS, max(RETRY_WAIT_MIN_SECONDS, 2 ** attempt))
+                    wait = random.uniform(RETRY_WAIT_MIN_SECONDS, high)
+                    _log_retry(attempt, exc, wait)
+                    await asyncio.sleep(wait)
+        return wrapper
 
 
 def parse_json_lenient(s: str) -> Dict[str, Any]:
@@ -68,19 +117,22 @@ def parse_json_lenient(s: str) -> Dict[str, Any]:
         return {}
     s = s.strip().replace("```json", "").replace("```", "")
     try:
-        return json.loads(s)
-    except Exception:
-        m = re.search(r"\{.*\}", s, flags=re.DOTALL)
-        return json.loads(m.group(0)) if m else {}
+        return json_loads(s)
+    except ValueError:
+        # Text around the object: take the outermost braces (same span the old greedy regex matched)
+        start, end = s.find("{"), s.rfind("}")
+        return json_loads(s[start:end + 1]) if 0 <= start < end else {}
 
 
 # ==================== OpenAI Wrapper ==================== #
-def run_openai_completion(system_prompt: str, user_content: str, json_mode: bool = False) -> Optional[str]:
-    def api_call():
-        # Truncate to avoid context window errors (approx 30k chars is safe for GPT-4o)
-        safe_content = user_content[:30000]
-
-        response = client.chat.completions.create(
+@retry_transient
+async def run_openai_completion(system_prompt: str, user_content: str, json_mode: bool = False) -> Optional[str]:
+    # Truncate to avoid context window errors (approx 30k chars is safe for GPT-4o)
+    safe_content = user_content[:30000]
+
+    # The backoff sleep happens outside the semaphore, so a waiting retry doesn't hold a slot
+    async with semaphore:
+        response = await client.chat.completions.create(
             model=OPENAI_MODEL_NAME,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -90,14 +142,12 @@ def run_openai_completion(system_prompt: str, user_content: str, json_mode: bool
             max_tokens=600,
             response_format={"type": "json_object"} if json_mode else None
         )
-        return response.choices[0].message.content
-
-    return call_with_retries(api_call)
+    return response.choices[0].message.content
 
 
 # ==================== SOCIETAL SENTIMENT (Towards Israel) ==================== #
-def get_societal_sentiment_with_llm(text_content: str) -> Dict[str, Any]:
-    system_prompt = f"""
+# Built once at import: every request sends byte-identical system content, so the prompt prefix is cached
+SOCIETAL_SYSTEM_PROMPT = f"""
 You are an expert political psychologist.
 TASK: Quantify the "Societal Sentiment" directed specifically **TOWARDS ISRAEL** (The State, its citizens, or its companies).
 
@@ -130,8 +180,10 @@ Input Text is in Hebrew. Respond in English.
 {_language_clause()}
 """
 
+
+async def get_societal_sentiment_with_llm(text_content: str) -> Dict[str, Any]:
     try:
-        content = run_openai_completion(system_prompt, text_content, json_mode=True)
+        content = await run_openai_completion(SOCIETAL_SYSTEM_PROMPT, text_content, json_mode=True)
         if not content:
             return {"sentiment_score": 0.0, "sentiment_label": "Error", "acting_group": "", "description": "",
                     "evidence": ""}
@@ -159,10 +211,12 @@ Input Text is in Hebrew. Respond in English.
 
 
 # ==================== SUMMARY ==================== #
-def get_summary_with_llm(text_content: str) -> str:
-    system_prompt = f"Summarize this Hebrew article in English (max 100 words). {_language_clause()}"
+SUMMARY_SYSTEM_PROMPT = f"Summarize this Hebrew article in English (max 100 words). {_language_clause()}"
+
+
+async def get_summary_with_llm(text_content: str) -> str:
     try:
-        return (run_openai_completion(system_prompt, text_content, json_mode=False) or "").strip()
+        return (await run_openai_completion(SUMMARY_SYSTEM_PROMPT, text_content, json_mode=False) or "").strip()
     except Exception:
         return ""
 
@@ -178,39 +232,51 @@ OUTPUT_COLUMNS = [
 ]
 
 
-def main():
+async def main():
     if not DATA_CSV_PATH.exists():
         raise FileNotFoundError(f"Missing CSV: {DATA_CSV_PATH}")
 
-    # Load Data
-    try:
-        df_input = pd.read_csv(DATA_CSV_PATH, encoding="utf-8-sig")
-    except UnicodeDecodeError:
-        df_input = pd.read_csv(DATA_CSV_PATH, encoding="utf-8")
+    # Load Data (streamed; utf-8-sig also reads files without a BOM). A missing optional column is just skipped
+    reader = pd.read_csv(
+        DATA_CSV_PATH, encoding="utf-8-sig", chunksize=INPUT_CHUNK_ROWS, usecols=lambda c: c in INPUT_COLUMNS
+    )
 
     # Prepare Output
     if not OUTPUT_CSV_PATH.exists():
         pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(OUTPUT_CSV_PATH, index=False, encoding="utf-8-sig")
 
-    df_existing = pd.read_csv(OUTPUT_CSV_PATH, encoding="utf-8-sig") if OUTPUT_CSV_PATH.exists() else pd.DataFrame()
-    processed_ids = set(df_existing[NEWS_ID_COLUMN].astype(str)) if not df_existing.empty else set()
+    # Read as strings, so NewsIDs compare equal to the ones written ("0123" stays "0123", not 123)
+    df_existing = pd.read_csv(
+        OUTPUT_CSV_PATH, encoding="utf-8-sig", usecols=[NEWS_ID_COLUMN], dtype=str, keep_default_na=False
+    )
+    processed_ids = set(df_existing[NEWS_ID_COLUMN])
 
-    print(f"--- Starting Sentiment Analysis (OpenAI Direct) on {len(df_input)} articles ---")
+    logger.info(f"--- Starting Sentiment Analysis (OpenAI Direct) on {DATA_CSV_PATH.name} ---")
 
-    for idx, row in df_input.iterrows():
+    pending = []
+
+    def flush():
+        if pending:
+            pd.DataFrame(pending, columns=OUTPUT_COLUMNS).to_csv(
+                OUTPUT_CSV_PATH, mode="a", header=False, index=False, encoding="utf-8-sig"
+            )
+            pending.clear()
+
+    async def process_row(idx, row):
         news_id = str(row.get(NEWS_ID_COLUMN, "")).strip()
         content = str(row.get(CONTENT_COLUMN, "")).strip()
 
         if not news_id or not content or news_id in processed_ids:
-            continue
-
-        print(f"Processing {idx + 1}/{len(df_input)} (ID={news_id})")
+            return
+        processed_ids.add(news_id)  # claimed now so a duplicate row running concurrently is skipped
 
-        # 1. Get Sentiment Score
-        sent_data = get_societal_sentiment_with_llm(content)
+        logger.info(f"Processing row {idx + 1} (ID={news_id})")
 
-        # 2. Get Summary
-        summary = get_summary_with_llm(content)
+        # 1. Sentiment score and 2. summary (independent prompts, sent together)
+        sent_data, summary = await asyncio.gather(
+            get_societal_sentiment_with_llm(content),
+            get_summary_with_llm(content),
+        )
 
         record = {
             "NewsID": news_id,
@@ -225,16 +291,19 @@ def main():
             "societal_evidence": sent_data.get("evidence", ""),
         }
 
-        pd.DataFrame([record], columns=OUTPUT_COLUMNS).to_csv(
-            OUTPUT_CSV_PATH, mode="a", header=False, index=False, encoding="utf-8-sig"
-        )
-        processed_ids.add(news_id)
+        pending.append(record)
+        if len(pending) >= OUTPUT_FLUSH_ROWS:
+            flush()
 
-        # Slight pause is polite, though OpenAI tier limits apply
-        time.sleep(0.5)
+    # Articles of a chunk run concurrently; the semaphore (not a sleep) keeps requests within the rate limit.
+    # Rows are plain dicts: to_dict("records") converts the chunk at once, where iterrows builds a Series per row
+    for chunk in reader:
+        rows = zip(chunk.index, chunk.to_dict("records"))
+        await asyncio.gather(*(process_row(idx, row) for idx, row in rows))
+        flush()  # an interrupted run loses at most one chunk, which the resume check re-runs
 
-    print(f"Results saved to: {OUTPUT_CSV_PATH}")
+    logger.info(f"Results saved to: {OUTPUT_CSV_PATH}")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
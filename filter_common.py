@@ -0,0 +1,589 @@
+"""
+Client, retry, cache and Batch API code shared by the Filter-3.x scripts.
+
+Each script supplies its own prompt (a messages function plus its system
+message) through RelevanceFilter; everything else is configured here once.
+"""
+import asyncio
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import re
+import sqlite3
+from pathlib import Path
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+try:
+    import faiss
+    import numpy as np
+except ImportError:  # semantic cache is optional; the exact-match cache still works
+    faiss = None
+
+try:
+    from orjson import dumps as orjson_dumps, loads as json_loads  # 2-5x faster on the per-response path
+except ImportError:
+    orjson_dumps = None
+    json_loads = json.loads
+
+try:
+    import tiktoken
+except ImportError:  # without it, content is clipped by characters instead
+    tiktoken = None
+
+# ==================== CONFIGURATION ==================== #
+
+# Standard OpenAI Configuration
+OPENAI_MODEL = "gpt-4o-mini"  # relevance is a binary call; the small model handles most articles
+# Verdicts with a confidence inside this range are re-checked with the full model
+ESCALATION_MODEL = "gpt-4.1"
+UNCERTAIN_CONFIDENCE = (0.4, 0.7)
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+# Concurrent requests in flight (raise/lower to match your account's rate limits)
+NUM_CONCURRENT = int(os.environ.get("OPENAI_CONCURRENCY", 16))
+MAX_RETRIES = 4
+RETRY_BACKOFF_SECONDS = 5
+MAX_RETRY_WAIT_SECONDS = 60
+
+# OpenAI Batch API (half price, results within 24h); run with --online for direct calls
+BATCH_MAX_REQUESTS = 50_000  # per input file (OpenAI limit)
+BATCH_MAX_BYTES = 190 * 1024 * 1024  # input files must stay under 200 MB
+BATCH_POLL_SECONDS = 60
+
+# Keyword gate: only articles naming BOTH sides (English/Turkish/Hebrew, incl. leaders) reach the LLM.
+# No word boundaries, so Turkish suffixes ("İsrail'in") and Hebrew prefixes ("בישראל") still match
+ISRAEL_PATTERN = re.compile(
+    r"israel|[iİı]srail|jerusalem|kudüs|netanyahu|peres|herzog|ישראל|ירושלים|נתניהו",
+    re.IGNORECASE,
+)
+TURKEY_PATTERN = re.compile(
+    r"turkey|turkish|türk|ankara|[iİı]stanbul|erdo[gğ]an|davuto[gğ]lu|טורקי|אנקרה|איסטנבול|ארדואן",
+    re.IGNORECASE,
+)
+
+# Articles judged per request on the online path (amortizes the system prompt over several rows)
+ARTICLES_PER_REQUEST = 8
+
+# Prompt -> response cache; reruns (e.g. while tuning prompts) only pay for new prompts
+CACHE_DB_PATH = Path("llm_cache.sqlite")
+# Near-duplicate articles reuse a cached verdict (needs faiss)
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_THRESHOLD = 0.95
+EMBEDDING_BATCH_SIZE = 256  # articles per embeddings request on the Batch API path
+
+# ==================== CLIENT SETUP ==================== #
+
+if not OPENAI_API_KEY:
+    raise ValueError("Please set your OPENAI_API_KEY environment variable.")
+
+# One connection pool shared by every request; HTTP/2 multiplexes them when the h2 package is installed
+http_client = httpx.AsyncClient(
+    http2=importlib.util.find_spec("h2") is not None,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    timeout=httpx.Timeout(60.0, connect=10.0),
+)
+
+# Initialize Standard OpenAI Client
+client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    http_client=http_client,
+)
+
+semaphore = asyncio.Semaphore(NUM_CONCURRENT)
+
+
+# Only these are worth retrying; anything else is a bug or a bad request and is raised at once
+TRANSIENT_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def _retry_after(exc):
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        if response.headers.get("retry-after-ms"):
+            return float(response.headers["retry-after-ms"]) / 1000.0
+        if response.headers.get("retry-after"):
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+async def call_with_retries(fn, max_attempts: int = MAX_RETRIES):
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await fn()
+        except TRANSIENT_ERRORS as exc:
+            if attempt == max_attempts:
+                raise
+            # The server's Retry-After is exact; otherwise back off exponentially
+            wait = _retry_after(exc)
+            if wait is None:
+                wait = min(MAX_RETRY_WAIT_SECONDS, RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            wait += random.uniform(0, 0.5)  # jitter keeps concurrent requests from retrying in lockstep
+            print(f"Attempt {attempt} failed ({exc}); retrying in {wait:.1f}s…")
+            await asyncio.sleep(wait)
+
+
+# ==================== RESPONSE CACHE ==================== #
+# Keyed by the model and the full prompt, so the filter scripts can share one file
+
+def open_cache():
+    db = sqlite3.connect(CACHE_DB_PATH)
+    db.execute("PRAGMA journal_mode=WAL")  # lets several scripts read/write the cache at once
+    db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response TEXT)")
+    return db
+
+
+cache_db = open_cache()
+
+
+def cache_key(messages, model=OPENAI_MODEL):
+    payload = json.dumps([model, messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cache_get(key):
+    row = cache_db.execute("SELECT response FROM cache WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def cache_put_many(items):
+    with cache_db:
+        cache_db.executemany("INSERT OR REPLACE INTO cache (key, response) VALUES (?, ?)", items)
+
+
+def cached(fn):
+    """
+    Serves fn(messages, ...) from the cache; only successful responses are stored.
+    Keyed on the model and messages, as each prompt always goes with the same response format.
+    """
+    @functools.wraps(fn)
+    async def wrapper(messages, **kwargs):
+        key = cache_key(messages, kwargs.get("model", OPENAI_MODEL))
+        response = cache_get(key)
+        if response is None:
+            response = await fn(messages, **kwargs)
+            cache_put_many([(key, response)])
+        return response
+    return wrapper
+
+
+class SemanticCache:
+    """
+    Reuses the response for a near-duplicate article (syndicated reprints,
+    shared boilerplate): content embeddings are kept in a faiss inner-product
+    index over L2-normalized vectors, and a cosine similarity above
+    SEMANTIC_CACHE_THRESHOLD counts as a hit. Entries are namespaced by the
+    prompt template, so the filter scripts never reuse each other's verdicts.
+    Disabled when faiss is not installed.
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.enabled = faiss is not None
+        self.index = None
+        self.responses = []
+        if self.enabled:
+            cache_db.execute(
+                "CREATE TABLE IF NOT EXISTS semantic "
+                "(namespace TEXT, key TEXT, vector BLOB, response TEXT, PRIMARY KEY (namespace, key))"
+            )
+            rows = cache_db.execute("SELECT vector, response FROM semantic WHERE namespace = ?", (namespace,))
+            for blob, response in rows:
+                self._add(np.frombuffer(blob, dtype="float32"), response)
+
+    def _add(self, vector, response):
+        vector = vector.reshape(1, -1)
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(vector.shape[1])
+        self.index.add(vector)
+        self.responses.append(response)
+
+    async def embed_many(self, texts):
+        async def api_call():
+            async with semaphore:
+                return await client.embeddings.create(
+                    model=EMBEDDING_MODEL,
+                    input=[text[:8192] or " " for text in texts],
+                )
+
+        response = await call_with_retries(api_call)
+        vectors = np.asarray([item.embedding for item in response.data], dtype="float32")
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def search(self, vector):
+        if self.index is None:
+            return None
+        scores, ids = self.index.search(vector.reshape(1, -1), 1)
+        if ids[0][0] >= 0 and scores[0][0] > SEMANTIC_CACHE_THRESHOLD:
+            return self.responses[ids[0][0]]
+        return None
+
+    def add_many(self, items):
+        # items: (content, vector, response)
+        rows = []
+        for content, vector, response in items:
+            self._add(vector, response)
+            key = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            rows.append((self.namespace, key, vector.tobytes(), response))
+        with cache_db:
+            cache_db.executemany(
+                "INSERT OR REPLACE INTO semantic (namespace, key, vector, response) VALUES (?, ?, ?, ?)", rows
+            )
+
+
+# ==================== PROMPT HELPERS ==================== #
+
+# gpt-4o / gpt-4.1 tokenizer
+ENCODING = tiktoken.get_encoding("o200k_base") if tiktoken else None
+
+
+def clip_content(content, max_tokens):
+    if ENCODING is None:
+        return content[:max_tokens * 4]  # ~4 characters per token
+    tokens = ENCODING.encode(content, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return content
+    return ENCODING.decode(tokens[:max_tokens])
+
+
+# The output format when several articles share one request (the filters' system messages have none)
+MULTI_ARTICLE_FORMAT = """
+The user message holds several numbered articles. Judge EACH article on its own and
+respond with this JSON object only, with exactly one entry per article:
+{"results": [{"id": 1, "is_relevant": true/false, "reason": "...", "confidence": 0.0-1.0}, ...]}
+where "id" is the article's number.
+"""
+
+
+REQUEST_PARAMS = {
+    "temperature": 0,
+}
+
+# Structured Outputs: the API only returns JSON matching these schemas
+RELEVANCE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_relevant": {"type": "boolean"},
+        "reason": {"type": "string"},
+        "confidence": {"type": "number"},
+    },
+    "required": ["is_relevant", "reason", "confidence"],
+    "additionalProperties": False,
+}
+RELEVANCE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "relevance", "strict": True, "schema": RELEVANCE_SCHEMA},
+}
+MULTI_ARTICLE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "relevance_results",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"id": {"type": "integer"}, **RELEVANCE_SCHEMA["properties"]},
+                        "required": ["id", "is_relevant", "reason", "confidence"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def parse_relevance(content):
+    result = json_loads(content)
+    # Responses cached before the confidence field existed count as certain
+    return (
+        result.get("is_relevant", False),
+        result.get("reason", "No reason provided"),
+        result.get("confidence", 1.0),
+    )
+
+
+def is_uncertain(verdict):
+    low, high = UNCERTAIN_CONFIDENCE
+    return low < verdict[2] < high
+
+
+def json_dumps(value):
+    # Non-ASCII is kept as is, like json.dumps(..., ensure_ascii=False)
+    if orjson_dumps is None:
+        return json.dumps(value, ensure_ascii=False)
+    return orjson_dumps(value).decode("utf-8")
+
+
+# Prompt tokens billed vs. served from OpenAI's automatic prompt cache (identical prefixes of 1024+ tokens)
+usage_stats = {"prompt_tokens": 0, "cached_tokens": 0}
+
+
+def record_usage(prompt_tokens, cached_tokens):
+    usage_stats["prompt_tokens"] += prompt_tokens or 0
+    usage_stats["cached_tokens"] += cached_tokens or 0
+
+
+@cached
+async def complete(messages, response_format=RELEVANCE_FORMAT, model=OPENAI_MODEL):
+    async def api_call():
+        async with semaphore:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+                **REQUEST_PARAMS
+            )
+        if response.usage:
+            details = response.usage.prompt_tokens_details
+            record_usage(response.usage.prompt_tokens, details.cached_tokens if details else 0)
+        return response.choices[0].message.content
+
+    return await call_with_retries(api_call)
+
+
+# ==================== BATCH API ==================== #
+
+def write_batch_files(requests, batch_input_path):
+    """
+    Writes (custom_id, messages) pairs as /v1/chat/completions batch requests,
+    starting a new file whenever the per-file request or size limit is reached.
+    """
+    paths, f, count, size = [], None, 0, 0
+    for custom_id, messages in requests:
+        line = json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": OPENAI_MODEL, "messages": messages, "response_format": RELEVANCE_FORMAT, **REQUEST_PARAMS},
+        }, ensure_ascii=False) + "\n"
+        data = line.encode("utf-8")
+        if f is None or count >= BATCH_MAX_REQUESTS or size + len(data) > BATCH_MAX_BYTES:
+            if f:
+                f.close()
+            path = batch_input_path.with_name(f"{batch_input_path.stem}_{len(paths)}.jsonl")
+            f = path.open("wb")
+            paths.append(path)
+            count, size = 0, 0
+        f.write(data)
+        count += 1
+        size += len(data)
+    if f:
+        f.close()
+    return paths
+
+
+async def run_batch_job(path):
+    """Uploads one batch file, waits for the job and returns {custom_id: content}."""
+    with path.open("rb") as f:
+        batch_file = await client.files.create(file=f, purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"Submitted batch {batch.id} ({path})")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_SECONDS)
+        batch = await client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        done = f"{counts.completed}/{counts.total}" if counts else "?"
+        print(f"Batch {batch.id}: {batch.status} ({done})")
+
+    if not batch.output_file_id:
+        print(f"Batch {batch.id} ended as '{batch.status}' with no output.")
+        return {}
+
+    output = await client.files.content(batch.output_file_id)
+    results = {}
+    for line in output.text.splitlines():
+        item = json_loads(line)
+        response = item.get("response") or {}
+        if response.get("status_code") == 200:
+            body = response["body"]
+            usage = body.get("usage") or {}
+            record_usage(usage.get("prompt_tokens"), (usage.get("prompt_tokens_details") or {}).get("cached_tokens"))
+            results[item["custom_id"]] = body["choices"][0]["message"]["content"]
+    return results
+
+
+# ==================== RELEVANCE CHECKS ==================== #
+
+class RelevanceFilter:
+    """
+    One filter prompt and everything run with it: single and multi-article
+    checks, escalation and the Batch API pass. messages(title, content) builds
+    the single-article request, with its own output format; system_message
+    holds the instructions without one and is followed by MULTI_ARTICLE_FORMAT
+    for multi-article requests.
+    """
+
+    def __init__(self, messages, system_message, batch_input_path):
+        self.messages = messages
+        self.system_message = system_message
+        self.batch_input_path = batch_input_path
+        # Namespaced by the prompt template, so a prompt change starts a fresh semantic cache
+        self.semantic_cache = SemanticCache(cache_key(messages("", "")))
+
+    def batch_messages(self, articles):
+        user_prompt = "Articles:\n" + "\n".join(
+            f"{n}. Title: {title}\nContent: {content}\n" for n, (title, content) in enumerate(articles, 1)
+        )
+
+        return [
+            {"role": "system", "content": self.system_message + "\n" + MULTI_ARTICLE_FORMAT},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    async def check(self, title, content):
+        """Judges one article, reusing the verdict for a near-duplicate when the semantic cache has one."""
+        try:
+            messages = self.messages(title, content)
+            vector = None
+            if self.semantic_cache.enabled and cache_get(cache_key(messages)) is None:
+                # Not seen verbatim: reuse the verdict for a near-duplicate article if there is one
+                vector = (await self.semantic_cache.embed_many([content]))[0]
+                response = self.semantic_cache.search(vector)
+                if response is not None:
+                    return parse_relevance(response)
+
+            response = await complete(messages)
+            if vector is not None:
+                self.semantic_cache.add_many([(content, vector, response)])
+            return parse_relevance(response)
+
+        except Exception as e:
+            return False, f"LLM Error: {str(e)}", 0.0
+
+    async def check_batch(self, articles):
+        """
+        Judges several (title, content) articles with one request. Articles already in
+        the exact or semantic cache are answered locally; an article missing from the
+        response, or in a request that failed, is checked on its own.
+        """
+        results = [None] * len(articles)
+        keys = [cache_key(self.messages(title, content)) for title, content in articles]
+        for i, key in enumerate(keys):
+            response = cache_get(key)
+            if response is not None:
+                try:
+                    results[i] = parse_relevance(response)
+                except ValueError:
+                    pass
+        pending = [i for i, result in enumerate(results) if result is None]
+
+        vectors = {}
+        if self.semantic_cache.enabled and len(pending) > 1:
+            embedded = await self.semantic_cache.embed_many([articles[i][1] for i in pending])
+            for i, vector in zip(pending, embedded):
+                response = self.semantic_cache.search(vector)
+                if response is None:
+                    vectors[i] = vector
+                else:
+                    results[i] = parse_relevance(response)
+            pending = [i for i in pending if results[i] is None]
+
+        if len(pending) > 1:
+            try:
+                response = await complete(
+                    self.batch_messages([articles[i] for i in pending]),
+                    response_format=MULTI_ARTICLE_RESPONSE_FORMAT,
+                )
+                answered = []
+                for entry in json_loads(response).get("results", []):
+                    n = int(entry.get("id", 0)) - 1
+                    if 0 <= n < len(pending) and results[pending[n]] is None:
+                        verdict = {
+                            "is_relevant": entry.get("is_relevant", False),
+                            "reason": entry.get("reason", "No reason provided"),
+                            "confidence": entry.get("confidence", 1.0),
+                        }
+                        results[pending[n]] = (verdict["is_relevant"], verdict["reason"], verdict["confidence"])
+                        answered.append((pending[n], json_dumps(verdict)))
+
+                # Stored per article, so later runs hit the cache however the articles are grouped
+                cache_put_many((keys[i], verdict) for i, verdict in answered)
+                if vectors:
+                    self.semantic_cache.add_many((articles[i][1], vectors[i], verdict) for i, verdict in answered)
+            except Exception as e:
+                print(f"Request for {len(pending)} articles failed ({e}); checking them one by one")
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        singles = await asyncio.gather(*(self.check(*articles[i]) for i in missing))
+        for i, result in zip(missing, singles):
+            results[i] = result
+        return results
+
+    async def escalate(self, title, content, verdict):
+        """Re-checks an uncertain verdict with ESCALATION_MODEL; the original verdict stands if that fails."""
+        try:
+            response = await complete(self.messages(title, content), model=ESCALATION_MODEL)
+            return parse_relevance(response)
+        except Exception as e:
+            print(f"Escalation failed ({e}); keeping the {OPENAI_MODEL} verdict")
+            return verdict
+
+    async def run_batch(self, df):
+        # Cached prompts are skipped; custom_id is the DataFrame index, which (unlike the ID column) is always unique
+        pending = {}  # custom_id -> (title, content)
+        blank = [""] * len(df)
+        titles = df["Title"] if "Title" in df else blank
+        contents = df["Content"] if "Content" in df else blank
+        for index, title, content in zip(df.index, titles, contents):
+            if cache_get(cache_key(self.messages(title, content))) is None:
+                pending[str(index)] = (title, content)
+
+        results, vectors = {}, {}
+        if self.semantic_cache.enabled:
+            # Near-duplicates of already-answered articles are not submitted at all
+            ids = list(pending)
+            for i in range(0, len(ids), EMBEDDING_BATCH_SIZE):
+                chunk = ids[i:i + EMBEDDING_BATCH_SIZE]
+                embedded = await self.semantic_cache.embed_many([pending[custom_id][1] for custom_id in chunk])
+                for custom_id, vector in zip(chunk, embedded):
+                    response = self.semantic_cache.search(vector)
+                    if response is None:
+                        vectors[custom_id] = vector
+                    else:
+                        results[custom_id] = response
+                        del pending[custom_id]
+
+        paths = write_batch_files(
+            ((custom_id, self.messages(title, content)) for custom_id, (title, content) in pending.items()),
+            self.batch_input_path,
+        )
+        outputs = await asyncio.gather(*(run_batch_job(path) for path in paths))
+        answered = {custom_id: content for output in outputs for custom_id, content in output.items()}
+
+        cache_put_many(
+            (cache_key(self.messages(*pending[custom_id])), content) for custom_id, content in answered.items()
+        )
+        if self.semantic_cache.enabled:
+            self.semantic_cache.add_many(
+                (pending[custom_id][1], vectors[custom_id], content) for custom_id, content in answered.items()
+            )
+
+        results.update(answered)
+        return results
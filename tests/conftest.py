@@ -0,0 +1,42 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# The Filter-3.x scripts import filter_common from their own directory
+sys.path.insert(0, str(REPO_ROOT))
+
+# Dummy credentials: the scripts check for them and build their clients at import time, but no test
+# makes a request
+SCRIPT_ENV = {
+    "OPENAI_API_KEY": "test-key",
+    "AZURE_OPENAI_ENDPOINT": "https://example.invalid",
+    "AZURE_OPENAI_KEY": "test-key",
+}
+
+
+@pytest.fixture
+def load_script(monkeypatch, tmp_path):
+    """
+    Imports a script by file name (several have hyphens, so they can't be imported normally).
+    Runs in a temporary directory, so response caches and outputs the script opens at import land there.
+    Skips the test when one of the script's dependencies is not installed.
+    """
+    for name, value in SCRIPT_ENV.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.chdir(tmp_path)
+
+    def load(file_name):
+        module_name = Path(file_name).stem.replace("-", "_").replace(".", "_")
+        spec = importlib.util.spec_from_file_location(module_name, REPO_ROOT / file_name)
+        module = importlib.util.module_from_spec(spec)
+        try:
+            spec.loader.exec_module(module)
+        except ImportError as e:
+            pytest.skip(f"{file_name}: {e}")
+        return module
+
+    return load
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("openai")
+
+
+@pytest.fixture
+def cameo(load_script):
+    return load_script("CAMEO-3.py")
+
+
+class FakeEmbeddings:
+    """Stands in for client.embeddings: texts equal up to case get the same vector."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.requests = []
+
+    async def create(self, model, input):
+        self.requests.append(list(input))
+        if self.fail:
+            raise RuntimeError("embeddings unavailable")
+        return SimpleNamespace(data=[SimpleNamespace(embedding=self.vector(text)) for text in input])
+
+    @staticmethod
+    def vector(text):
+        return list(hashlib.sha256(text.lower().encode("utf-8")).digest()[:16])
+
+
+@pytest.fixture
+def semantic_cache(cameo, monkeypatch, tmp_path):
+    pytest.importorskip("faiss")
+    embeddings = FakeEmbeddings()
+    monkeypatch.setattr(cameo, "client", SimpleNamespace(embeddings=embeddings))
+    monkeypatch.setattr(cameo, "EMBEDDING_BATCH_SIZE", 2)
+    return cameo.ResponseCache(tmp_path / "semantic.sqlite"), embeddings
+
+
+def test_lookup_many_embeds_in_batches(semantic_cache):
+    cache, embeddings = semantic_cache
+    asyncio.run(cache.store_many("cameo", [("Israel and Turkey", {"events": [1]})]))
+    embeddings.requests.clear()
+
+    texts = ["ISRAEL AND TURKEY", "a", "b", "c", "Israel and Turkey"]
+    hits = asyncio.run(cache.lookup_many("cameo", texts))
+
+    assert hits == [{"events": [1]}, None, None, None, {"events": [1]}]
+    # The exact hit is never embedded; the four misses go out two per request
+    assert embeddings.requests == [["ISRAEL AND TURKEY", "a"], ["b", "c"]]
+
+
+def test_cache_errors_are_misses(semantic_cache):
+    cache, embeddings = semantic_cache
+    asyncio.run(cache.store_many("cameo", [("stored", {"events": []})]))
+    embeddings.fail = True
+
+    # The exact hit survives; the failed embeddings call only makes the rest misses
+    assert asyncio.run(cache.lookup_many("cameo", ["stored", "other"])) == [{"events": []}, None]
+    asyncio.run(cache.store_many("cameo", [("new", {"events": [2]})]))
+    assert asyncio.run(cache.lookup("cameo", "new")) == {"events": [2]}
+
+    cache.conn.close()
+    assert asyncio.run(cache.lookup("cameo", "stored")) is None
+    asyncio.run(cache.store("cameo", "another", {"events": []}))
+
+
+def read_requests(paths):
+    return [[json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()] for path in paths]
+
+
+def test_write_batch_files_splits_on_request_count(cameo, monkeypatch, tmp_path):
+    monkeypatch.setattr(cameo, "BATCH_INPUT_PATH", tmp_path / "batch.jsonl")
+    monkeypatch.setattr(cameo, "BATCH_API_MAX_REQUESTS", 2)
+    # Repeated and empty NewsIDs still give one distinct custom_id per row
+    rows = [(idx, {}, news_id, f"article {idx}") for idx, news_id in enumerate(["7", "7", "", "", "8"])]
+
+    paths = cameo.write_batch_files(rows)
+
+    files = read_requests(paths)
+    assert [len(requests) for requests in files] == [2, 2, 1]
+    assert [request["custom_id"] for requests in files for request in requests] == ["0", "1", "2", "3", "4"]
+    assert files[0][1]["body"]["messages"][-1]["content"].endswith("article 1")
+
+
+def test_write_batch_files_splits_on_size(cameo, monkeypatch, tmp_path):
+    monkeypatch.setattr(cameo, "BATCH_INPUT_PATH", tmp_path / "batch.jsonl")
+    rows = [(idx, {}, str(idx), "x" * 100) for idx in range(3)]
+    one_request = cameo.write_batch_files(rows[:1])[0].stat().st_size
+    monkeypatch.setattr(cameo, "BATCH_API_MAX_BYTES", 2 * one_request)
+
+    paths = cameo.write_batch_files(rows)
+
+    assert [len(requests) for requests in read_requests(paths)] == [2, 1]
+    assert all(path.stat().st_size <= 2 * one_request for path in paths)
+
+
+def test_get_cameo_events_batch_keys_articles_by_position(cameo, monkeypatch):
+    monkeypatch.setattr(cameo.response_cache, "semantic", False)
+    asyncio.run(cameo.response_cache.store("cameo", "cached", {"summary": "from cache", "events": []}))
+
+    async def run_chat_completion(messages, **kwargs):
+        articles = json.loads(messages[-1]["content"].split("\n\n", 1)[1])
+        # Answers all but the last article, in reverse order
+        return json.dumps({"results": [
+            {"news_id": article["id"], "summary": article["text"], "events": []} for article in articles[-2::-1]
+        ]})
+
+    async def get_cameo_events_with_llm(text):
+        return {"summary": f"single {text}", "events": []}
+
+    monkeypatch.setattr(cameo, "run_chat_completion", run_chat_completion)
+    monkeypatch.setattr(cameo, "get_cameo_events_with_llm", get_cameo_events_with_llm)
+
+    results = asyncio.run(cameo.get_cameo_events_batch(["a", "cached", "b", "c"]))
+
+    assert [result["summary"] for result in results] == ["a", "from cache", "b", "single c"]
+
+
+class ByteEncoding:
+    """One token per UTF-8 byte: the most tokens any text can take."""
+
+    @staticmethod
+    def encode(text, disallowed_special=()):
+        return list(text.encode("utf-8"))
+
+    @staticmethod
+    def decode(ids):
+        return bytes(ids).decode("utf-8", errors="ignore")
+
+
+def test_truncate_to_tokens_counts_multibyte_characters(cameo, monkeypatch):
+    monkeypatch.setattr(cameo, "ENCODING", ByteEncoding())
+    # Fewer characters than max_tokens, but two tokens each
+    assert cameo.truncate_to_tokens("ş" * 80, max_tokens=100) == "ş" * 50
+    assert cameo.truncate_to_tokens("short", max_tokens=100) == "short"
+    assert cameo.truncate_to_tokens("a" * 100, max_tokens=100) == "a" * 100
+
+
+def test_truncate_to_tokens_without_tiktoken(cameo, monkeypatch):
+    monkeypatch.setattr(cameo, "ENCODING", None)
+    assert cameo.truncate_to_tokens("a" * 1000, max_tokens=100) == "a" * 400
+
+
+@pytest.mark.parametrize("code, top_level, expected", [
+    ("0311", "", ("0311", "03")),
+    ("311", "", ("0311", "03")),  # leading zero restored
+    ("019", "05", ("019", "01")),  # the top level comes from the code, not the model
+    ("19", "", ("19", "19")),
+    (" 190 ", "", ("190", "19")),
+])
+def test_validate_accepts_codebook_codes(cameo, code, top_level, expected):
+    ev = {"cameo_code": code, "cameo_top_level": top_level}
+    assert cameo.validate(ev)
+    assert (ev["cameo_code"], ev["cameo_top_level"]) == expected
+
+
+@pytest.mark.parametrize("ev, top_level", [
+    ({"cameo_code": "999", "cameo_top_level": "4"}, "04"),
+    ({"cameo_code": "", "cameo_top_level": "21"}, ""),
+    ({}, ""),
+])
+def test_validate_rejects_unknown_codes(cameo, ev, top_level):
+    assert not cameo.validate(ev)
+    assert (ev["cameo_code"], ev["cameo_top_level"]) == ("", top_level)
+
+
+EVENT = {"event_order": 1, "source_actor": "TUR", "target_actor": "ISR", "cameo_top_level": "11",
+         "cameo_code": "111", "event_description": "", "evidence": "", "confidence": 0.9}
+
+
+def test_parse_llm_json_complete_response(cameo):
+    content = json.dumps({"summary": "s", "events": [EVENT]})
+    assert cameo.parse_llm_json(content) == {"summary": "s", "events": [EVENT]}
+
+
+def test_parse_llm_json_keeps_complete_events_of_a_cut_off_response(cameo):
+    if cameo.from_json is None:
+        pytest.skip("partial recovery needs jiter")
+    content = json.dumps({"summary": "s", "events": [EVENT, EVENT]})
+    data = cameo.parse_llm_json(content[:-40])
+
+    assert data["partial"] is True
+    assert data["summary"] == "s"
+    assert data["events"] == [EVENT]
+
+
+def test_parse_llm_json_drops_the_last_article_of_a_cut_off_batch(cameo):
+    if cameo.from_json is None:
+        pytest.skip("partial recovery needs jiter")
+    results = [{"news_id": str(i), "summary": "s", "events": [EVENT]} for i in range(3)]
+    content = json.dumps({"results": results})
+    data = cameo.parse_llm_json(content[:-10])
+
+    assert data["partial"] is True
+    assert data["results"] == results[:2]
+
+
+def test_parse_llm_json_rejects_garbage(cameo):
+    with pytest.raises(ValueError):
+        cameo.parse_llm_json("not json")
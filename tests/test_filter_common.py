@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+
+@pytest.fixture
+def common(load_script):
+    return load_script("filter_common.py")
+
+
+class ByteEncoding:
+    """One token per UTF-8 byte."""
+
+    @staticmethod
+    def encode(text, disallowed_special=()):
+        return list(text.encode("utf-8"))
+
+    @staticmethod
+    def decode(ids):
+        return bytes(ids).decode("utf-8", errors="ignore")
+
+
+def test_clip_content_without_tiktoken(common, monkeypatch):
+    monkeypatch.setattr(common, "ENCODING", None)
+    assert common.clip_content("a" * 1000, 100) == "a" * 400
+    assert common.clip_content("short", 100) == "short"
+
+
+def test_clip_content_with_encoding(common, monkeypatch):
+    monkeypatch.setattr(common, "ENCODING", ByteEncoding())
+    assert common.clip_content("ş" * 80, 100) == "ş" * 50
+    assert common.clip_content("a" * 100, 100) == "a" * 100
+
+
+def read_requests(paths):
+    return [[json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()] for path in paths]
+
+
+def test_write_batch_files_splits_on_request_count(common, monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "BATCH_MAX_REQUESTS", 2)
+    requests = [(str(i), [{"role": "user", "content": f"article {i}"}]) for i in range(5)]
+
+    paths = common.write_batch_files(requests, tmp_path / "batch.jsonl")
+
+    assert [path.name for path in paths] == ["batch_0.jsonl", "batch_1.jsonl", "batch_2.jsonl"]
+    files = read_requests(paths)
+    assert [[request["custom_id"] for request in requests] for requests in files] == [["0", "1"], ["2", "3"], ["4"]]
+    assert files[2][0]["body"]["messages"] == requests[4][1]
+
+
+def test_write_batch_files_splits_on_size(common, monkeypatch, tmp_path):
+    requests = [(str(i), [{"role": "user", "content": "ü" * 100}]) for i in range(3)]
+    one_request = common.write_batch_files(requests[:1], tmp_path / "one.jsonl")[0].stat().st_size
+    monkeypatch.setattr(common, "BATCH_MAX_BYTES", 2 * one_request)
+
+    paths = common.write_batch_files(requests, tmp_path / "batch.jsonl")
+
+    assert [len(requests) for requests in read_requests(paths)] == [2, 1]
+    assert all(path.stat().st_size <= 2 * one_request for path in paths)
+
+
+def test_write_batch_files_without_requests(common, tmp_path):
+    assert common.write_batch_files([], tmp_path / "batch.jsonl") == []
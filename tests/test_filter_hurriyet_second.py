@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+openai = pytest.importorskip("openai")
+
+ARTICLES = [
+    "Israel and Turkey signed a trade deal in Ankara.",
+    "İsrail Dışişleri Bakanı Türkiye'ye geldi.",
+    "ISRAELI DIPLOMATS MET IN ISTANBUL",
+    "The prime minister visited Istanbul.",
+    "Netanyahu spoke to the cabinet about Gaza.",
+    "ראש הממשלה נפגש עם ארדואן",
+    "Weather in Ankara is sunny.",
+    "Tidford council elected a new mayor.",
+    "Israelis travel abroad.",
+    "",
+]
+EXPECTED = [True, True, True, True, True, True, False, False, False, False]
+
+
+@pytest.fixture
+def second(load_script):
+    module = load_script("Filter_Hurriyet_second.py")
+    yield module
+    module.keyword_verdicts.clear()
+
+
+def column_paths(module, monkeypatch):
+    """Yields (name, module) once per keyword_filter_column implementation available here."""
+    if module.KEYWORD_AUTOMATON is not None:
+        yield "automaton", module
+    with monkeypatch.context() as m:
+        m.setattr(module, "KEYWORD_AUTOMATON", None)
+        module.keyword_verdicts.clear()
+        if module.pl is not None:
+            yield "polars", module
+        m.setattr(module, "pl", None)
+        yield "re", module
+    module.keyword_verdicts.clear()
+
+
+def test_keyword_filter_column_paths_agree(second, monkeypatch):
+    contents = pd.Series(ARTICLES, index=range(10, 20))
+    for name, module in column_paths(second, monkeypatch):
+        result = module.keyword_filter_column(contents)
+        assert result.tolist() == EXPECTED, name
+        assert result.index.equals(contents.index), name
+        assert [module.cheap_keyword_filter(text) for text in ARTICLES] == EXPECTED, name
+
+
+@pytest.mark.parametrize("articles", [[], ["nothing here", "weather in ankara"], ["Israel"]])
+def test_keyword_filter_column_without_matches(second, monkeypatch, articles):
+    contents = pd.Series(articles, dtype=object)
+    for name, module in column_paths(second, monkeypatch):
+        assert module.keyword_filter_column(contents).tolist() == [False] * len(articles), name
+
+
+def test_call_with_retries_retries_transient_errors(second, monkeypatch):
+    httpx = pytest.importorskip("httpx")
+
+    async def no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(second.asyncio, "sleep", no_sleep)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise openai.APIConnectionError(request=httpx.Request("POST", "https://example.invalid"))
+        return '{"relevant": true}'
+
+    assert asyncio.run(second.call_with_retries(flaky)) == '{"relevant": true}'
+    assert len(calls) == 3
+
+    async def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    calls.clear()
+    with pytest.raises(ValueError):
+        asyncio.run(second.call_with_retries(broken))
+    assert len(calls) == 1
+
+
+def test_keyword_verdicts_are_bounded(second, monkeypatch):
+    monkeypatch.setattr(second, "KEYWORD_CACHE_SIZE", 2)
+    for text in ARTICLES[:5]:
+        second.cheap_keyword_filter(text)
+    assert len(second.keyword_verdicts) == 2
+    assert all(isinstance(key, bytes) and len(key) == 16 for key in second.keyword_verdicts)
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("tqdm")
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+SCRIPTS = ["Filter-3.1.py", "Filter-3.2.py", "Filter-3.3.py"]
+
+
+@pytest.mark.parametrize("file_name", SCRIPTS)
+def test_each_request_has_one_output_format(load_script, file_name):
+    script = load_script(file_name)
+    relevance = script.relevance
+    single = relevance.messages("Title", "Content")[0]["content"]
+    multi = relevance.batch_messages([("A", "a"), ("B", "b")])[0]["content"]
+
+    assert single.count("is_relevant") == 1
+    assert multi.count("is_relevant") == 1
+    assert '"results"' in multi
+    assert single.startswith(relevance.system_message) and multi.startswith(relevance.system_message)
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("openai")
+
+
+def test_resume_skips_ids_already_in_the_output(load_script, monkeypatch, tmp_path):
+    societal = load_script("Societal_sentiment.py")
+    input_path, output_path = tmp_path / "input.csv", tmp_path / "output.csv"
+    # "x1" keeps the input's NewsID column as strings, so "0123" reaches the output unchanged
+    pd.DataFrame({"NewsID": ["0123", "x1"], "Content": ["old", "new"]}).to_csv(input_path, index=False)
+    pd.DataFrame([{"NewsID": "0123", "summary": "done"}], columns=societal.OUTPUT_COLUMNS).to_csv(
+        output_path, index=False, encoding="utf-8-sig"
+    )
+    monkeypatch.setattr(societal, "DATA_CSV_PATH", input_path)
+    monkeypatch.setattr(societal, "OUTPUT_CSV_PATH", output_path)
+    # The script's buffered stderr handler would outlive pytest's captured stderr; records go to caplog instead
+    for handler in societal.logger.handlers:
+        handler.close()
+    monkeypatch.setattr(societal.logger, "handlers", [])
+
+    coded = []
+
+    async def get_societal_sentiment_with_llm(text):
+        coded.append(text)
+        return {}
+
+    async def get_summary_with_llm(text):
+        return "summary"
+
+    monkeypatch.setattr(societal, "get_societal_sentiment_with_llm", get_societal_sentiment_with_llm)
+    monkeypatch.setattr(societal, "get_summary_with_llm", get_summary_with_llm)
+
+    asyncio.run(societal.main())
+
+    assert coded == ["new"]
+    assert pd.read_csv(output_path, dtype=str)["NewsID"].tolist() == ["0123", "x1"]